@@ -0,0 +1,65 @@
+"""
+   This script measures how rendering a long track scales with the number of
+   worker processes (see Sequence.renderParallel in sound.py).
+
+   It builds a random track, renders it serially once, then in parallel with
+   every number of workers given, and reports the time taken, how much faster
+   than real time it is, and the speedup over the serial render. It also checks
+   that every parallel render is identical to the serial one.
+
+   Usage: python benchmark.py [--minutes M] [--workers N [N ...]] [--seed S]
+"""
+import argparse, hashlib, os, random, time
+
+import sound
+
+PITCHES = [name + accidental + octave for name in 'ABCDEFG' for accidental in ('', '+', '-') for octave in '3456']
+LENGTHS = [0.125, 0.25, 0.5, 1, 2]
+
+def random_track(minutes, seed=0, instrument='raw3'):
+    generator = random.Random(seed)
+    track = sound.Sequence(instrument=instrument)
+    total = 0
+    while total < minutes * 60:
+        length = generator.choice(LENGTHS)
+        track.addNote(generator.choice(PITCHES), length=length)
+        total += length
+    return track
+
+def serial(track):
+    sound.WAVETABLES.clear()
+    start = time.perf_counter()
+    chunks = list(track.render())
+    elapsed = time.perf_counter() - start
+    digest = hashlib.sha1()
+    for chunk in chunks:
+        digest.update(chunk)
+    return elapsed, digest.hexdigest()
+
+#The cache is cleared first, since forked workers would inherit it
+def parallel(track, workers):
+    sound.WAVETABLES.clear()
+    start = time.perf_counter()
+    with track.renderParallel(workers) as rendered:
+        elapsed = time.perf_counter() - start
+        digest = hashlib.sha1(rendered.buffer).hexdigest()
+    return elapsed, digest
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compare serial and parallel rendering of a long track.")
+    parser.add_argument('--minutes', type=float, default=10, help="length of the track")
+    parser.add_argument('--workers', type=int, nargs='*', help="numbers of worker processes to try")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    counts = args.workers or sorted(set([1, 2, 4, os.cpu_count()]))
+
+    track = random_track(args.minutes, args.seed)
+    duration = track.nframes() / track.framerate
+    print("Track: %d notes, %.1f minutes, %d CPUs" % (len(track.notes), duration / 60, os.cpu_count()))
+    print("%-12s %10s %12s %10s %10s" % ('mode', 'seconds', 'x realtime', 'speedup', 'identical'))
+    baseline, expected = serial(track)
+    print("%-12s %10.2f %12.1f %10s %10s" % ('serial', baseline, duration / baseline, '1.00', 'yes'))
+    for workers in counts:
+        elapsed, digest = parallel(track, workers)
+        print("%-12s %10.2f %12.1f %10.2f %10s" % ('%d workers' % workers, elapsed, duration / elapsed,
+                                                  baseline / elapsed, 'yes' if digest == expected else 'NO'))
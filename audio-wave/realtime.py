@@ -0,0 +1,156 @@
+"""
+   This module plays a Sequence or a Timeline (see sound.py) in real time.
+
+   A renderer thread produces fixed-size blocks of frames ahead of time, and
+   keeps at most `buffers` of them ready (double buffering by default). The
+   player hands one block to the sink every block duration, e.g. every 11.6 ms
+   for 512 frames at 44.1 kHz, just like a sound card would ask for them. If the
+   next block is not ready in time, that is an underrun: a block of silence is
+   played instead and counted, so the statistics show whether rendering keeps up.
+   The latency is bounded by the blocks buffered ahead.
+
+   The sink is a callback taking the bytes of every block, or anything with a
+   sendall() (a socket) or write() method (a pipe or file).
+
+   Usage: python realtime.py [--block FRAMES] [--buffers N] [--framerate HZ] [--stdout]
+   Without --stdout the demo melody is played into a local pipe, which is read
+   and thrown away, and the statistics are printed. With --stdout the raw frames
+   are written to standard output, e.g. python realtime.py --stdout | aplay -f cd
+"""
+import argparse, os, queue, sys, threading, time
+
+import sound
+
+#This function turns a socket, a file object or a callback into a callback
+def sinkFor(target):
+    if hasattr(target, 'sendall'):
+        return target.sendall
+    if hasattr(target, 'write'):
+        def write(block):
+            target.write(block)
+            target.flush()
+        return write
+    if callable(target):
+        return target
+    raise TypeError('Should be a socket, a file object or a callable')
+
+#This function re-blocks a stream of chunks of bytes, e.g. the notes of a Sequence,
+#which each end with a short chunk, into blocks of exactly block_bytes. The last
+#block is padded with silence.
+def fixedBlocks(chunks, block_bytes):
+    pending = bytearray()
+    for chunk in chunks:
+        pending += chunk
+        while len(pending) >= block_bytes:
+            yield bytes(pending[:block_bytes])
+            del pending[:block_bytes]
+    if pending:
+        yield bytes(pending) + bytes(block_bytes - len(pending))
+
+class RealtimePlayer():
+    def __init__(self, source, sink, block_frames=512, buffers=2):
+        self.source = source
+        self.sink = sinkFor(sink)
+        self.block_frames = block_frames
+        self.block_time = block_frames / source.framerate
+        self.blocks = queue.Queue(maxsize=buffers)
+        self.running = False
+        self.stats = {'blocks': 0, 'underruns': 0, 'late_writes': 0,
+                      'render_ms_max': 0.0, 'render_ms_total': 0.0,
+                      'block_ms': round(self.block_time * 1000, 3),
+                      'max_latency_ms': round(self.block_time * (buffers + 1) * 1000, 3)}
+
+    #This method runs on the renderer thread
+    def render(self):
+        blocks = fixedBlocks(self.source.render(self.block_frames), self.block_frames * 4)
+        while self.running:
+            start = time.perf_counter()
+            block = next(blocks, None)
+            elapsed = (time.perf_counter() - start) * 1000
+            self.stats['render_ms_total'] += elapsed
+            self.stats['render_ms_max'] = max(self.stats['render_ms_max'], elapsed)
+            self.blocks.put(block)
+            if block is None:
+                return
+
+    #This method plays the whole source, blocking until it is done or stop() is
+    #called, and returns the statistics
+    def play(self):
+        self.running = True
+        renderer = threading.Thread(target=self.render, daemon=True)
+        renderer.start()
+        #Let the renderer fill the buffers before the clock starts, like a sound card would
+        while self.blocks.qsize() < self.blocks.maxsize and renderer.is_alive():
+            time.sleep(self.block_time / 4)
+        silence = bytes(self.block_frames * 4)
+        deadline = time.perf_counter()
+        while self.running:
+            try:
+                block = self.blocks.get(timeout=max(deadline - time.perf_counter(), 0))
+            except queue.Empty:
+                self.stats['underruns'] += 1
+                block = silence
+            if block is None:
+                break
+            delay = time.perf_counter() - deadline
+            if delay > 0:
+                #The block is late, don't wait for the next deadline
+                if delay > self.block_time:
+                    self.stats['late_writes'] += 1
+            else:
+                time.sleep(-delay)
+            self.sink(block)
+            self.stats['blocks'] += 1
+            deadline += self.block_time
+        self.running = False
+        try:
+            self.blocks.get_nowait()
+        except queue.Empty:
+            pass
+        renderer.join()
+        return self.stats
+
+    def stop(self):
+        self.running = False
+
+#This function builds the melody played by the demo
+def demo(framerate):
+    timeline = sound.Timeline(framerate, instrument='raw2')
+    melody = "C C G G A A G F F E E D D C".split()
+    for i, pitch in enumerate(melody):
+        timeline.addNote(i * 0.4, pitch + '4', length=0.4)
+        if i % 2 == 0:
+            timeline.addNote(i * 0.4, pitch + '3', length=0.8, instrument='raw')
+    return timeline
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Play the demo melody in real time.")
+    parser.add_argument('--block', type=int, default=512, help="frames per block")
+    parser.add_argument('--buffers', type=int, default=2, help="blocks rendered ahead")
+    parser.add_argument('--framerate', type=int, default=44100)
+    parser.add_argument('--stdout', action='store_true', help="write the raw frames to standard output")
+    args = parser.parse_args()
+
+    timeline = demo(args.framerate)
+    if args.stdout:
+        stats = RealtimePlayer(timeline, sys.stdout.buffer, args.block, args.buffers).play()
+        print(stats, file=sys.stderr)
+        sys.exit()
+
+    read_end, write_end = os.pipe()
+    received = [0]
+    def drain():
+        with os.fdopen(read_end, 'rb') as pipe:
+            for data in iter(lambda: pipe.read1(65536), b''):
+                received[0] += len(data)
+    reader = threading.Thread(target=drain)
+    reader.start()
+    with os.fdopen(write_end, 'wb') as pipe:
+        start = time.perf_counter()
+        stats = RealtimePlayer(timeline, pipe, args.block, args.buffers).play()
+        elapsed = time.perf_counter() - start
+    reader.join()
+    print("played %.2f s of audio in %.2f s, %d bytes received" %
+          (timeline.nframes() / args.framerate, elapsed, received[0]))
+    for key, value in stats.items():
+        print("%-16s %s" % (key, round(value, 3)))
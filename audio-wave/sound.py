@@ -1,7 +1,16 @@
-import wave, random, struct, re
+import wave, random, re, threading
 from builtins import TypeError
-import math
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from multiprocessing import shared_memory
+import math, os
+import numpy as np
 
+# Number of frames rendered at a time when streaming
+CHUNK_FRAMES = 8192
+
+@lru_cache(maxsize=None)
 def pitchToFrequency(pitch_notation):
     MAP = { 'A': 1,
             'B': 3,
@@ -25,35 +34,37 @@ def pitchToFrequency(pitch_notation):
     return frequency
 
 def inst_raw(i, wavelength):
-    value = (5000 * math.sin( i * (2 * math.pi / wavelength) ))
+    value = (5000 * np.sin( i * (2 * math.pi / wavelength) ))
     return value
 
 def inst_raw2(i, wavelength):
-    value = (5000 * math.sin( i * (2 * math.pi / wavelength) ))   \
-            + (2500 * math.sin( i * (2 * math.pi / (2 * wavelength))))
+    value = (5000 * np.sin( i * (2 * math.pi / wavelength) ))   \
+            + (2500 * np.sin( i * (2 * math.pi / (2 * wavelength))))
     return value
 
 def inst_raw3(i, wavelength):
-    value = (5000 * math.sin( i * (2 * math.pi / wavelength) ))   \
-            + (2500 * math.sin( i * (2 * math.pi / (2 * wavelength))))   \
-            + (1250 * math.sin( i * (2 * math.pi / (4 * wavelength))))
+    value = (5000 * np.sin( i * (2 * math.pi / wavelength) ))   \
+            + (2500 * np.sin( i * (2 * math.pi / (2 * wavelength))))   \
+            + (1250 * np.sin( i * (2 * math.pi / (4 * wavelength))))
     return value
 
 def inst_third(i, wavelength):
-    value = (4000 * math.sin( i * (2 * math.pi / wavelength) ))   \
-            + (2000 * math.sin( i * (2 * math.pow(2, (4/12) * math.pi / wavelength ))))
+    value = (4000 * np.sin( i * (2 * math.pi / wavelength) ))   \
+            + (2000 * np.sin( i * (2 * math.pow(2, (4/12) * math.pi / wavelength ))))
     return value
 
 def inst_fourth(i, wavelength):
-    value = (4000 * math.sin( i * (2 * math.pi / wavelength) ))   \
-            + (2000 * math.sin( i * (2 * math.pow(2, (5/12)) * math.pi / wavelength)))
+    value = (4000 * np.sin( i * (2 * math.pi / wavelength) ))   \
+            + (2000 * np.sin( i * (2 * math.pow(2, (5/12)) * math.pi / wavelength)))
     return value
 
 def inst_fifth(i, wavelength):
-    value = (4000 * math.sin( i * (2 * math.pi / wavelength) ))   \
-            + (2000 * math.sin( i * (2 * math.pow(2, (7/12)) * math.pi / wavelength)))
+    value = (4000 * np.sin( i * (2 * math.pi / wavelength) ))   \
+            + (2000 * np.sin( i * (2 * math.pow(2, (7/12)) * math.pi / wavelength)))
     return value
 
+# The wavefunctions take either one sample index or a whole array of them,
+# in which case they return the array of values in one go.
 INSTRUMENT_WAVEFUNCTIONS = {
                             'raw': inst_raw,
                             'raw2': inst_raw2,
@@ -63,6 +74,103 @@ INSTRUMENT_WAVEFUNCTIONS = {
                             'fifth': inst_fifth,
                             }
 
+# This function rounds float samples to 16-bit values. Values out of the
+# 16-bit range, e.g. from several loud notes mixed together, are clipped.
+def samplesToInt16(values):
+    return np.clip(np.rint(values), -32768, 32767).astype(np.int16)
+
+# This function converts float samples to interleaved 16-bit stereo frames,
+# every value is written twice, once for each channel, see samplesToInt16()
+def samplesToBytes(values):
+    return np.repeat(samplesToInt16(values), 2).tobytes()
+
+# This function writes frames, given by an iterable of chunks of bytes, as WAV to a
+# writable file object. The number of frames is written in the header up front,
+# so the file object does not need to be seekable.
+def writeFrames(fileobj, framerate, nframes, chunks):
+    output = wave.open(fileobj, 'wb')
+    output.setparams((2, 2, framerate, nframes, 'NONE', 'not compressed'))
+    for chunk in chunks:
+        output.writeframesraw(chunk)
+    output.close()
+
+# This class caches the rendered samples of notes, keyed by
+# (pitch, instrument, framerate, intensity), so that a note repeated in a melody
+# is only synthesized once. The table of a key has room for the longest note
+# seen with it, and is filled as far as the frames asked for so far, so that
+# streaming a note a chunk at a time only synthesizes each chunk once; shorter
+# notes with the same key are slices of it. The least recently used tables are
+# dropped once the cache holds more than max_bytes, and notes too long to ever
+# fit are synthesized directly, uncached.
+# The slices handed out are read-only, since the same table is shared.
+class Wavetable():
+    def __init__(self, nframes, previous=None):
+        self.data = np.empty(nframes)
+        self.filled = 0
+        if previous is not None:
+            self.filled = previous.filled
+            self.data[:self.filled] = previous.data[:self.filled]
+
+class WavetableCache():
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.tables = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def samples(self, note, start, stop):
+        nframes = max(stop, note.nframes())
+        if nframes * 8 > self.max_bytes:
+            return note.synthesize(start, stop)
+        key = (note.pitch, note.instrument, note.framerate, note.intensity)
+        with self.lock:
+            table = self.tables.get(key)
+            if table is not None and table.filled >= stop:
+                self.tables.move_to_end(key)
+                self.hits += 1
+            else:
+                self.misses += 1
+                if table is None or len(table.data) < stop:
+                    table = Wavetable(max(nframes, len(table.data)) if table is not None else nframes, table)
+                    self.store(key, table)
+                else:
+                    self.tables.move_to_end(key)
+                table.data[table.filled:stop] = note.synthesize(table.filled, stop)
+                table.filled = stop
+            values = table.data[start:stop]
+        values.flags.writeable = False
+        return values
+
+    # Must be called with the lock held
+    def store(self, key, table):
+        previous = self.tables.pop(key, None)
+        if previous is not None:
+            self.nbytes -= previous.data.nbytes
+        self.tables[key] = table
+        self.nbytes += table.data.nbytes
+        while self.nbytes > self.max_bytes:
+            _, evicted = self.tables.popitem(last=False)
+            self.nbytes -= evicted.data.nbytes
+
+    def clear(self):
+        with self.lock:
+            self.tables.clear()
+            self.nbytes = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups else None,
+                'entries': len(self.tables),
+                'bytes': self.nbytes,
+                'max_bytes': self.max_bytes}
+
+# The cache used by all notes; set WAVETABLES.max_bytes = 0 to turn it off
+WAVETABLES = WavetableCache()
+
 class Note():
     def __init__(self, framerate, pitch='A', length=1, intensity=0, noise=0, instrument='raw'):
         self.framerate = framerate
@@ -76,17 +184,68 @@ class Note():
         self.wavelength = self.framerate / self.frequency
         self.wavefunction = INSTRUMENT_WAVEFUNCTIONS[self.instrument]
     
+    # Returns the samples of the note from frame start to stop, from the wavetable cache
+    def samples(self, start=0, stop=None):
+        if stop is None:
+            stop = self.nframes()
+        return WAVETABLES.samples(self, start, stop)
+
+    # Computes the samples of the note from frame start to stop
+    def synthesize(self, start, stop):
+        i = np.arange(start, stop, dtype=np.float64)
+        return self.intensity + self.wavefunction(i, self.wavelength)
+#                     + np.random.randint(-self.noise, self.noise, len(i))
+
+    def nframes(self):
+        return round(self.length * self.framerate)
+
     def toBytes(self):
-        values = []
-        for i in range(0, round(self.length * self.framerate)):
-            value = self.intensity + self.wavefunction(i, self.wavelength)
-#                     + random.randint(-self.noise, self.noise)   \
-            packed_value = struct.pack('h', round(value))
-            values.append(packed_value)
-            values.append(packed_value)
-        value_bytes = (b''.join(values))
+        value_bytes = samplesToBytes(self.samples())
         return value_bytes
 
+    # Same bytes as toBytes(), but produced chunk_frames frames at a time
+    def chunks(self, chunk_frames=CHUNK_FRAMES):
+        nframes = self.nframes()
+        for start in range(0, nframes, chunk_frames):
+            yield samplesToBytes(self.samples(start, min(start + chunk_frames, nframes)))
+
+# This class is a buffer of rendered frames in shared memory, which worker
+# processes write into directly. Use it as a context manager, or call close(),
+# to free the memory; views taken from buffer must be released before.
+class SharedRender():
+    def __init__(self, nframes):
+        self.nframes = nframes
+        self.nbytes = nframes * 4
+        self.shm = shared_memory.SharedMemory(create=True, size=max(self.nbytes, 1))
+        self.buffer = self.shm.buf[:self.nbytes]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.buffer.release()
+        self.shm.close()
+        self.shm.unlink()
+
+# This function runs in a worker process. It renders a range of notes into the
+# shared buffer, starting at frame offset, in the same layout as toBytes().
+def renderInto(name, offset, notes):
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        for note in notes:
+            nframes = note.nframes()
+            frames = np.ndarray((nframes, 2), dtype=np.int16, buffer=shm.buf, offset=offset * 4)
+            for start in range(0, nframes, CHUNK_FRAMES):
+                stop = min(start + CHUNK_FRAMES, nframes)
+                frames[start:stop] = samplesToInt16(note.samples(start, stop))[:, None]
+            del frames
+            offset += nframes
+    finally:
+        shm.close()
+
 class Sequence():
     def __init__(self, framerate=44100, intensity=0, instrument=None):
         self.notes = []
@@ -107,11 +266,115 @@ class Sequence():
             kwargs['intensity'] = self.intensity
         self.notes.append(Note(self.framerate, *args, **kwargs))
     
-    def writeWav(self, filename):
-        noise_output = wave.open(filename+'.wav', 'w')
-        noise_output.setparams((2, 2, self.framerate, 0, 'NONE', 'not compressed'))
-        value_bytes = b''
+    def nframes(self):
+        return sum(note.nframes() for note in self.notes)
+
+    # Generator of the frames of the whole sequence, a chunk at a time,
+    # so memory use does not depend on the length of the track
+    def render(self, chunk_frames=CHUNK_FRAMES):
         for note in self.notes:
-            value_bytes += note.toBytes()
-        noise_output.writeframes(value_bytes)
-        noise_output.close()
\ No newline at end of file
+            yield from note.chunks(chunk_frames)
+
+    # Writes the sequence as WAV to any writable file object, e.g. an open file,
+    # sys.stdout.buffer or socket.makefile('wb'), see writeFrames()
+    def writeStream(self, fileobj):
+        writeFrames(fileobj, self.framerate, self.nframes(), self.render())
+
+    # Splits the notes into about `parts` contiguous ranges of similar length,
+    # and returns them as (frame offset, notes) pairs
+    def split(self, parts):
+        nframes = [note.nframes() for note in self.notes]
+        offsets = np.concatenate(([0], np.cumsum(nframes)))
+        bounds = np.searchsorted(offsets, np.linspace(0, offsets[-1], parts + 1))
+        bounds = sorted(set(bounds.tolist()) | {0, len(self.notes)})
+        return [(int(offsets[begin]), self.notes[begin:end])
+                for begin, end in zip(bounds, bounds[1:]) if end > begin]
+
+    # Renders the sequence on a pool of worker processes, each one writing its
+    # range of notes straight to its place in a SharedRender, which is returned.
+    # The frames are the same as the ones of render().
+    def renderParallel(self, workers=None):
+        workers = workers or os.cpu_count()
+        output = SharedRender(self.nframes())
+        try:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                tasks = [executor.submit(renderInto, output.shm.name, offset, notes)
+                         for offset, notes in self.split(workers * 4)]
+                for task in tasks:
+                    task.result()
+        except BaseException:
+            output.close()
+            raise
+        return output
+
+    # With workers other than 1, the sequence is rendered in parallel
+    # (see renderParallel), which needs memory for the whole track.
+    def writeWav(self, filename, workers=1):
+        with open(filename+'.wav', 'wb') as wav_file:
+            if workers == 1:
+                self.writeStream(wav_file)
+                return
+            with self.renderParallel(workers) as rendered:
+                writeFrames(wav_file, self.framerate, rendered.nframes, [rendered.buffer])
+
+# This class places notes at any time on a timeline, so that they can overlap,
+# e.g. chords, or several instruments playing at once.
+# The timeline is mixed a block of frames at a time: the samples of the notes
+# playing during the block are added up in a float buffer, which is then clipped
+# and converted to 16-bit frames once. Notes are sorted by start time, so each
+# block only looks at the notes playing in it, not at the whole timeline.
+class Timeline():
+    def __init__(self, framerate=44100, intensity=0, instrument=None):
+        self.voices = []
+        self.framerate = framerate
+        self.intensity = intensity
+        self.instrument = instrument
+
+    # Adds a note starting at `start` seconds
+    def add(self, note, start):
+        if type(note) != Note:
+            raise TypeError('Should be a Note object')
+        self.voices.append((round(start * self.framerate), note))
+
+    def addNote(self, start, *args, **kwargs):
+        if not 'instrument' in kwargs.keys() and self.instrument:
+            kwargs['instrument'] = self.instrument
+        if not 'intensity' in kwargs.keys() and self.intensity:
+            kwargs['intensity'] = self.intensity
+        self.add(Note(self.framerate, *args, **kwargs), start)
+
+    # Adds the notes of a sequence one after the other, from `start` seconds
+    def addSequence(self, sequence, start=0):
+        offset = round(start * self.framerate)
+        for note in sequence.notes:
+            self.voices.append((offset, note))
+            offset += note.nframes()
+
+    def nframes(self):
+        return max((start + note.nframes() for start, note in self.voices), default=0)
+
+    # Generator of the mixed frames, block_frames frames at a time
+    def render(self, block_frames=CHUNK_FRAMES):
+        voices = sorted(self.voices, key=lambda voice: voice[0])
+        nframes = self.nframes()
+        active, waiting = [], 0
+        for block_start in range(0, nframes, block_frames):
+            block_stop = min(block_start + block_frames, nframes)
+            while waiting < len(voices) and voices[waiting][0] < block_stop:
+                active.append(voices[waiting])
+                waiting += 1
+            mix = np.zeros(block_stop - block_start)
+            for start, note in active:
+                first = max(start, block_start)
+                last = min(start + note.nframes(), block_stop)
+                if last > first:
+                    mix[first - block_start:last - block_start] += note.samples(first - start, last - start)
+            active = [(start, note) for start, note in active if start + note.nframes() > block_stop]
+            yield samplesToBytes(mix)
+
+    def writeStream(self, fileobj):
+        writeFrames(fileobj, self.framerate, self.nframes(), self.render())
+
+    def writeWav(self, filename):
+        with open(filename+'.wav', 'wb') as wav_file:
+            self.writeStream(wav_file)
@@ -0,0 +1,97 @@
+"""
+Benchmark of the breadth-first-search implementations in utils.py.
+
+Compares the original BFS (a list used as a queue, popping its first element),
+the deque-based bfs_edges, and the level-synchronous bfs_arrays, on the bundled
+ca-GrQc dataset and on a random graph with a million nodes.
+
+Usage: python benchmark.py [--nodes N] [--degree D] [--old-max N] [--seed S]
+"""
+import argparse
+import os
+import time
+
+import networkx as nx
+import numpy as np
+
+import utils
+
+DATASET = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'datasets', 'ca-GrQc.txt')
+
+def list_bfs_edges(G, size, source):
+    """
+    The original bfs_edges, whose frontier is a list.
+    """
+    visited=set([source])
+    stack = [(source,iter(G[source]))]
+    while stack and len(visited) != size:
+        parent,children = stack[0]
+        try:
+            child = next(children)
+
+            if child not in visited:
+                yield parent,child
+                visited.add(child)
+                stack.append((child,iter(G[child])))
+
+        except StopIteration:
+            stack.pop(0)
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return time.perf_counter() - start, result
+
+def count(edges):
+    return sum(1 for _ in edges)
+
+def report(name, size, seconds, edges, baseline=None):
+    speedup = '%.1fx' % (baseline / seconds) if baseline else ''
+    print('%-28s %10s %10.4f %10d %10s' % (name, size, seconds, edges, speedup))
+
+def compare(G, source, C, compact_source, sizes, old_max):
+    """
+    Time a search of every size with each implementation. The generators
+    search G from source, bfs_arrays searches the CompactGraph C from
+    compact_source, the same node. A size of None searches the whole component.
+    """
+    for size in sizes:
+        limit = size or -1
+        baseline = None
+        if (size or len(G)) <= old_max:
+            baseline, edges = timed(lambda: count(list_bfs_edges(G, limit, source)))
+            report('list frontier (original)', size or 'all', baseline, edges)
+        seconds, edges = timed(lambda: count(utils.bfs_edges(G, limit, source)))
+        report('deque frontier', size or 'all', seconds, edges, baseline)
+        seconds, (parents, children) = timed(utils.bfs_arrays, C, size, compact_source)
+        report('level-synchronous arrays', size or 'all', seconds, len(children), baseline)
+
+def random_graph(nodes, degree, seed):
+    """
+    A random graph with nodes * degree / 2 edges, as a CompactGraph.
+    """
+    rng = np.random.default_rng(seed)
+    edges = rng.integers(0, nodes, (nodes * degree // 2, 2))
+    return utils.CompactGraph.from_edges(edges)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the BFS implementations.')
+    parser.add_argument('--nodes', type=int, default=1000000, help='nodes of the random graph')
+    parser.add_argument('--degree', type=int, default=8, help='average degree of the random graph')
+    parser.add_argument('--old-max', type=int, default=100000,
+                        help='largest search run with the original implementation, which is quadratic')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    print('%-28s %10s %10s %10s %10s' % ('implementation', 'size', 'seconds', 'edges', 'speedup'))
+    G = nx.read_edgelist(DATASET, nodetype=int)
+    C = utils.CompactGraph.from_edgelist(DATASET)
+    source = max(G.degree(), key=lambda item: item[1])[0]
+    print('ca-GrQc, networkx graph: %d nodes, %d edges' % (G.order(), G.size()))
+    compare(G, source, C, C.index(source), [100, 1000, None], args.old_max)
+    print('ca-GrQc, CompactGraph')
+    compare(C, C.index(source), C, C.index(source), [100, 1000, None], args.old_max)
+
+    seconds, R = timed(random_graph, args.nodes, args.degree, args.seed)
+    print('random CompactGraph: %d nodes, %d edges, built in %.1f s' % (R.order(), R.size(), seconds))
+    compare(R, 0, R, 0, [1000, 10000, 100000, None], args.old_max)
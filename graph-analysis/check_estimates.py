@@ -0,0 +1,75 @@
+"""
+Check the estimates of utils.estimate_path_metrics against the exact values
+computed by networkx on the bundled ca-GrQc dataset.
+
+Reports, for betweenness and closeness centrality, the largest and the mean
+absolute error over all nodes next to the epsilon bound, and compares the
+diameter bounds and the average distance with the exact ones, along with the
+time taken by both. Computing the exact values takes a few minutes.
+
+Usage: python check_estimates.py [--epsilon E] [--delta D] [--pivots K]
+                                 [--time-budget SECONDS] [--workers N] [--seed S]
+"""
+import argparse
+import os
+import time
+
+import networkx as nx
+import numpy as np
+
+import utils
+
+DATASET = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'datasets', 'ca-GrQc.txt')
+
+def exact_metrics(G):
+    """
+    The exact values, keyed by the integer node ids of the CompactGraph.
+    """
+    N = G.to_networkx(original_ids=False)
+    n = N.order()
+    start = time.perf_counter()
+    betweenness = nx.betweenness_centrality(N)
+    closeness = nx.closeness_centrality(N)
+    total, pairs, diameter = 0, 0, 0
+    for source, lengths in nx.all_pairs_shortest_path_length(N):
+        distances = list(lengths.values())
+        total += sum(distances)
+        pairs += len(distances) - 1
+        diameter = max(diameter, max(distances))
+    return {
+        'betweenness': np.array([betweenness[v] for v in range(n)]),
+        'closeness': np.array([closeness[v] for v in range(n)]),
+        'diameter': diameter,
+        'average_distance': total / float(pairs),
+        'elapsed': time.perf_counter() - start,
+    }
+
+def errors(estimate, exact):
+    known = ~np.isnan(estimate)
+    error = np.abs(estimate[known] - exact[known])
+    return error.max(), error.mean(), int((~known).sum())
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare estimated path metrics with exact ones.')
+    parser.add_argument('--epsilon', type=float, default=0.05)
+    parser.add_argument('--delta', type=float, default=0.1)
+    parser.add_argument('--pivots', type=int, help='number of pivots, instead of the one given by epsilon')
+    parser.add_argument('--time-budget', type=float)
+    parser.add_argument('--workers', type=int)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    G = utils.CompactGraph.from_edgelist(DATASET)
+    estimate = utils.estimate_path_metrics(G, args.epsilon, args.delta, args.pivots, args.time_budget,
+                                           args.workers, args.seed)
+    print('Estimated from %d pivots in %.2f s, epsilon %.4f with probability %.2f'
+          % (estimate['pivots'], estimate['elapsed'], estimate['epsilon'], 1 - estimate['delta']))
+    exact = exact_metrics(G)
+    print('Exact values computed in %.2f s' % exact['elapsed'])
+
+    for name in ('betweenness', 'closeness'):
+        largest, mean, unknown = errors(estimate[name], exact[name])
+        print('%-12s max error %.5f, mean error %.5f, %d nodes not estimated' % (name, largest, mean, unknown))
+    print('diameter     estimated between %d and %d, exact %d' % (estimate['diameter'] + (exact['diameter'],)))
+    print('avg distance estimated %.4f, exact %.4f' % (estimate['average_distance'], exact['average_distance']))
+    print('eff diameter estimated %d' % estimate['effective_diameter'])
@@ -22,7 +22,18 @@
 # OTHER DEALINGS IN THE SOFTWARE.
 
 
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from contextlib import contextmanager
+import math
+import json
+import os
+import shutil
+import tempfile
+import time
+
 import networkx as nx
+import numpy as np
 import random
 
 
@@ -31,28 +42,791 @@ def bfs_edges(G, size, source):
     Produce edges in a breadth-first-search starting at source.
     Based on D. Eppstein implementation of BFS published in July, 2004.
     Reference: http://www.ics.uci.edu/~eppstein/PADS/BFS.py
+    The search stops once size nodes have been visited. The frontier is a
+    deque, so that taking the next node off it takes constant time.
     """
     visited=set([source])
-    stack = [(source,iter(G[source]))]
-    while stack and len(visited) != size:
-        parent,children = stack[0]
+    queue = deque([(source,iter(G[source]))])
+    while queue and len(visited) != size:
+        parent,children = queue[0]
         try:
             child = next(children)
 
             if child not in visited:
                 yield parent,child
                 visited.add(child)
-                stack.append((child,iter(G[child])))
+                queue.append((child,iter(G[child])))
 
         except StopIteration:
-            stack.pop(0)
+            queue.popleft()
+
+def expand(G, frontier):
+    """
+    Return the edges leaving the nodes of frontier in a CompactGraph, as
+    (origins, neighbors) arrays, in frontier order then adjacency order.
+    """
+    starts = G.indptr[frontier]
+    degrees = G.indptr[frontier + 1] - starts
+    offsets = np.repeat(starts - np.cumsum(degrees) + degrees, degrees)
+    neighbors = G.indices[offsets + np.arange(int(degrees.sum()))].astype(np.int64)
+    return np.repeat(frontier, degrees), neighbors
+
+def bfs_arrays(G, size, source):
+    """
+    Level-synchronous breadth-first-search on a CompactGraph. The whole
+    frontier is expanded at once with array operations, and the edges are
+    returned as two arrays (parents, children), in the same order as
+    bfs_edges produces them, stopping once size nodes have been visited.
+    Use size=None to visit the whole connected component of source.
+    """
+    n = G.number_of_nodes()
+    if size is None or size > n:
+        size = n
+    visited = np.zeros(n, dtype=bool)
+    visited[source] = True
+    first = np.empty(n, dtype=np.int64)
+    frontier = np.array([source], dtype=np.int64)
+    parents, children = [], []
+    count = 1
+    while len(frontier) and count < size:
+        origins, candidates = expand(G, frontier)
+        new = ~visited[candidates]
+        candidates, origins = candidates[new], origins[new]
+        # Keep only the first time every node is reached, in frontier order
+        positions = np.arange(len(candidates))
+        first[candidates[::-1]] = positions[::-1]
+        keep = first[candidates] == positions
+        candidates, origins = candidates[keep][:size - count], origins[keep][:size - count]
+        visited[candidates] = True
+        parents.append(origins)
+        children.append(candidates)
+        count += len(candidates)
+        frontier = candidates
+    if not parents:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    return np.concatenate(parents), np.concatenate(children)
 
 def bfs_sample(G, size, source=None):
-    if not source:
-        source = random.choice(G.nodes())
+    """
+    Sample a connected subgraph of G by breadth-first-search from source,
+    or from a random node. G is a networkx graph or a CompactGraph.
+    """
+    if source is None:
+        if isinstance(G, CompactGraph):
+            source = random.randrange(G.number_of_nodes())
+        else:
+            source = random.choice(list(G.nodes()))
 
-    edges = bfs_edges(G, size, source)
     H = nx.Graph()
-    for edge in edges:
-        H.add_edge(*edge)
+    if isinstance(G, CompactGraph):
+        parents, children = bfs_arrays(G, size, source)
+        H.add_edges_from(zip(parents.tolist(), children.tolist()))
+    else:
+        H.add_edges_from(bfs_edges(G, size, source))
     return H
+
+def sorted_unique(values):
+    """
+    Same as np.unique(values) for integers, but sorts in place and is
+    much faster on tens of millions of values.
+    """
+    values = np.sort(values)
+    if not len(values):
+        return values
+    new = np.empty(len(values), dtype=bool)
+    new[0] = True
+    np.not_equal(values[1:], values[:-1], out=new[1:])
+    return values[new]
+
+def relabel(ids):
+    """
+    Return (labels, inverse) like np.unique(ids, return_inverse=True).
+    SNAP ids are mostly dense, so a lookup table indexed by id is used
+    when the range of ids is not much larger than their number.
+    """
+    labels = sorted_unique(ids)
+    if not len(labels):
+        return labels, np.zeros(0, dtype=np.int64)
+    low, high = labels[0], labels[-1]
+    if high - low < 4 * len(ids) + 1024:
+        table = np.empty(high - low + 1, dtype=np.int64)
+        table[labels - low] = np.arange(len(labels))
+        return labels, table[ids - low]
+    return labels, np.searchsorted(labels, ids)
+
+def csr_arrays(edges, n):
+    """
+    Return the CSR arrays (indptr, indices) of an undirected graph with nodes
+    0..n-1, given an (m, 2) array of its edges. Duplicates are merged.
+    """
+    edges = edges.astype(np.int64)
+    source = np.concatenate((edges[:, 0], edges[:, 1]))
+    target = np.concatenate((edges[:, 1], edges[:, 0]))
+    keys = sorted_unique(source * n + target)
+    indptr = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(keys // n, minlength=n), out=indptr[1:])
+    index_type = np.int32 if n < 2**31 else np.int64
+    return indptr, (keys % n).astype(index_type)
+
+class CompactGraph(object):
+    """
+    Undirected graph stored as compressed sparse rows (CSR) of NumPy arrays.
+    Nodes are relabeled 0..n-1 and the neighbors of node v are
+    indices[indptr[v]:indptr[v+1]], sorted. labels[v] is the original id of v.
+    This takes about 8 bytes per edge instead of hundreds for a networkx.Graph,
+    and supports enough of its interface (G[v], len(G), G.nodes()) for
+    bfs_edges and bfs_sample to run on it, using the integer node ids.
+    """
+    FILES = ('indptr', 'indices', 'labels')
+
+    def __init__(self, indptr, indices, labels, path=None):
+        self.indptr = indptr
+        self.indices = indices
+        self.labels = labels
+        self.path = path
+
+    @classmethod
+    def from_edges(cls, edges):
+        """
+        Build the graph from an (m, 2) array of edges between arbitrary
+        integer ids. Duplicate edges, in either direction, are merged.
+        """
+        edges = np.asarray(edges).reshape(-1, 2)
+        labels, inverse = relabel(edges.ravel())
+        indptr, indices = csr_arrays(inverse.reshape(-1, 2), len(labels))
+        return cls(indptr, indices, labels)
+
+    @classmethod
+    def from_edgelist(cls, path, cache=False):
+        """
+        Parse a SNAP edge list, one tab-separated pair of integer ids per line
+        and "#" comments, in bulk. With cache=True the arrays are saved next to
+        the file, in path + ".csr", and memory-mapped by later calls as long as
+        the file has not changed since.
+        """
+        cache_dir = path + '.csr'
+        stamp = {'size': os.path.getsize(path), 'mtime': os.path.getmtime(path)}
+        if cache:
+            try:
+                with open(os.path.join(cache_dir, 'source.json')) as f:
+                    if json.load(f) == stamp:
+                        return cls.load(cache_dir)
+            except (IOError, OSError, ValueError):
+                pass
+        edges = np.loadtxt(path, dtype=np.int64, comments='#', ndmin=2)
+        G = cls.from_edges(edges)
+        if cache:
+            G.save(cache_dir)
+            with open(os.path.join(cache_dir, 'source.json'), 'w') as f:
+                json.dump(stamp, f)
+        return G
+
+    @classmethod
+    def from_networkx(cls, G):
+        nodes = list(G)
+        index = dict((node, i) for i, node in enumerate(nodes))
+        edges = np.array([(index[u], index[v]) for u, v in G.edges()], dtype=np.int64)
+        indptr, indices = csr_arrays(edges.reshape(-1, 2), len(nodes))
+        labels = np.empty(len(nodes), dtype=object)
+        labels[:] = nodes
+        return cls(indptr, indices, labels)
+
+    def save(self, path):
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        for name in self.FILES:
+            np.save(os.path.join(path, name + '.npy'), getattr(self, name))
+        self.path = path
+
+    @classmethod
+    def load(cls, path, mmap_mode='r'):
+        """
+        Load a graph saved with save(). The arrays are memory-mapped by
+        default, so loading is immediate and pages are read on demand.
+        """
+        arrays = []
+        for name in cls.FILES:
+            try:
+                arrays.append(np.load(os.path.join(path, name + '.npy'), mmap_mode=mmap_mode))
+            except ValueError:
+                # Labels that are not numbers, e.g. from a networkx graph, are pickled
+                arrays.append(np.load(os.path.join(path, name + '.npy'), allow_pickle=True))
+        return cls(*arrays, path=path)
+
+    def number_of_nodes(self):
+        return len(self.indptr) - 1
+
+    def number_of_edges(self):
+        loops = int(np.count_nonzero(self.rows() == self.indices))
+        return (len(self.indices) + loops) // 2
+
+    order = number_of_nodes
+    size = number_of_edges
+
+    def degree(self):
+        return np.diff(self.indptr)
+
+    def rows(self):
+        """
+        Return the source node of every entry of indices.
+        """
+        return np.repeat(np.arange(self.number_of_nodes()), np.diff(self.indptr))
+
+    def neighbors(self, v):
+        return self.indices[self.indptr[v]:self.indptr[v + 1]]
+
+    def nodes(self):
+        return range(self.number_of_nodes())
+
+    def index(self, label):
+        """
+        Return the integer id of the node with the given original id.
+        """
+        positions = np.flatnonzero(self.labels == label)
+        if not len(positions):
+            raise KeyError(label)
+        return int(positions[0])
+
+    def to_networkx(self, original_ids=True):
+        rows = self.rows()
+        upper = rows <= self.indices
+        G = nx.Graph()
+        if original_ids:
+            G.add_nodes_from(self.labels.tolist())
+            G.add_edges_from(zip(self.labels[rows[upper]].tolist(), self.labels[self.indices[upper]].tolist()))
+        else:
+            G.add_nodes_from(range(self.number_of_nodes()))
+            G.add_edges_from(zip(rows[upper].tolist(), self.indices[upper].tolist()))
+        return G
+
+    def __getitem__(self, v):
+        return self.neighbors(v)
+
+    def __contains__(self, v):
+        return 0 <= v < self.number_of_nodes()
+
+    def __iter__(self):
+        return iter(self.nodes())
+
+    def __len__(self):
+        return self.number_of_nodes()
+
+
+def random_walk_arrays(G, size, source, rng, restart=0.15, max_steps=None):
+    """
+    Random-walk sampling on a CompactGraph. The walk starts at source, moves
+    to a random neighbor at every step, and jumps back to source with
+    probability restart. It stops once size nodes have been visited, or after
+    max_steps steps (100 * size by default), and returns the edges through
+    which every node was first reached, as (parents, children) arrays.
+    """
+    if max_steps is None:
+        max_steps = 100 * size
+    visited = set([source])
+    parents, children = [], []
+    node = source
+    indptr, indices = G.indptr, G.indices
+    # Random numbers are drawn in blocks, which is much faster than one by one
+    jumps, picks = rng.random(max_steps), rng.random(max_steps)
+    for step in range(max_steps):
+        if len(visited) >= size:
+            break
+        start, stop = int(indptr[node]), int(indptr[node + 1])
+        if stop == start or jumps[step] < restart:
+            node = source
+            continue
+        child = int(indices[start + int(picks[step] * (stop - start))])
+        if child not in visited:
+            visited.add(child)
+            parents.append(node)
+            children.append(child)
+        node = child
+    return np.array(parents, dtype=np.int64), np.array(children, dtype=np.int64)
+
+def forest_fire_arrays(G, size, source, rng, forward=0.7):
+    """
+    Forest-fire sampling on a CompactGraph (Leskovec and Faloutsos, 2006).
+    Every burning node sets fire to a geometrically distributed number, with
+    mean forward / (1 - forward), of its neighbors not burnt yet, picked at
+    random. If the fire dies out before size nodes are burnt, it starts again
+    from a random neighbor, not burnt yet, of a random burnt node, so every
+    burnt node but source is reached through one of the returned edges, and
+    the sample is connected. As with bfs_arrays, the sample stops at the
+    connected component of source. Returns the edges the fire spread through,
+    as (parents, children) arrays.
+    """
+    n = G.number_of_nodes()
+    size = min(size, n)
+    burnt = set([source])
+    queue = deque([source])
+    # Burnt nodes that may still have neighbors not burnt, to restart from
+    candidates = [source]
+    parents, children = [], []
+    while len(burnt) < size:
+        if not queue:
+            while candidates:
+                i = int(rng.integers(len(candidates)))
+                node = candidates[i]
+                neighbors = [int(v) for v in G.neighbors(node) if int(v) not in burnt]
+                if neighbors:
+                    break
+                candidates[i] = candidates[-1]
+                candidates.pop()
+            else:
+                break
+            child = neighbors[int(rng.integers(len(neighbors)))]
+            burnt.add(child)
+            parents.append(node)
+            children.append(child)
+            queue.append(child)
+            candidates.append(child)
+            continue
+        node = queue.popleft()
+        neighbors = [int(v) for v in G.neighbors(node) if int(v) not in burnt]
+        if not neighbors:
+            continue
+        count = min(rng.geometric(1 - forward) - 1, len(neighbors), size - len(burnt))
+        for child in rng.choice(neighbors, count, replace=False).tolist():
+            burnt.add(child)
+            parents.append(node)
+            children.append(child)
+            queue.append(child)
+            candidates.append(child)
+    return np.array(parents, dtype=np.int64), np.array(children, dtype=np.int64)
+
+SAMPLERS = {
+    'bfs': lambda G, size, source, rng: bfs_arrays(G, size, source),
+    'random_walk': random_walk_arrays,
+    'forest_fire': forest_fire_arrays,
+}
+
+# The graph shared by the tasks run in a worker process, see sample_batch
+WORKER_GRAPH = None
+
+def open_worker_graph(path):
+    global WORKER_GRAPH
+    WORKER_GRAPH = CompactGraph.load(path)
+
+@contextmanager
+def worker_pool(G, workers):
+    """
+    A process pool whose workers memory-map the arrays of the CompactGraph G
+    into WORKER_GRAPH, from G.path, or from a temporary copy if G was not
+    saved. The graph is never pickled.
+    """
+    temporary = None
+    path = G.path
+    if path is None:
+        temporary = tempfile.mkdtemp(prefix='graph-')
+        path = temporary
+        CompactGraph(G.indptr, G.indices, G.labels).save(path)
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=open_worker_graph,
+                                 initargs=(path,)) as executor:
+            yield executor
+    finally:
+        if temporary:
+            shutil.rmtree(temporary)
+
+def sample_task(method, size, source, seed):
+    """
+    Draw one sample from WORKER_GRAPH. The random generator is made from the
+    sample's own seed, so the sample does not depend on the worker or on the
+    other samples. Without a source, a random one is drawn from the same
+    generator.
+    """
+    G = WORKER_GRAPH
+    rng = np.random.default_rng(seed)
+    if source is None:
+        source = int(rng.integers(G.number_of_nodes()))
+    parents, children = SAMPLERS[method](G, size, source, rng)
+    return np.column_stack((parents, children))
+
+def sample_batch(G, size, sources=None, count=None, method='bfs', workers=None, random_state=None):
+    """
+    Draw many samples of size nodes from the CompactGraph G in parallel.
+    Either give the start nodes in sources, or the number of samples in count
+    to start from random nodes. method is 'bfs', 'random_walk' or 'forest_fire'.
+    Every sample gets its own random stream, spawned from random_state with
+    np.random.SeedSequence, so a batch is the same whatever the number of
+    workers. The graph is not sent to the workers: they memory-map its saved
+    arrays, G.path, or a temporary copy if G was not saved. Returns a list of
+    (k, 2) arrays of edges, one per sample, in order, through which every
+    sampled node but the start one was reached: k is size - 1, unless the
+    connected component of the start node is smaller, or a random walk runs
+    out of steps.
+    """
+    if method not in SAMPLERS:
+        raise ValueError('Unknown sampling method: %s' % method)
+    if sources is None:
+        if count is None:
+            raise ValueError('Either sources or count must be given')
+        sources = [None] * count
+    seeds = np.random.SeedSequence(random_state).spawn(len(sources))
+    tasks = [(method, size, source, seed) for source, seed in zip(sources, seeds)]
+    if workers == 1:
+        global WORKER_GRAPH
+        WORKER_GRAPH = G
+        try:
+            return [sample_task(*task) for task in tasks]
+        finally:
+            WORKER_GRAPH = None
+    workers = workers or os.cpu_count()
+    with worker_pool(G, workers) as executor:
+        chunksize = max(1, len(tasks) // (4 * workers))
+        return list(executor.map(sample_task, *zip(*tasks), chunksize=chunksize))
+
+
+def iter_edgelist(path):
+    """
+    Produce the edges of a SNAP edge list one at a time, as pairs of strings,
+    skipping "#" comments, without loading the whole file.
+    """
+    with open(path) as f:
+        for line in f:
+            if line.startswith('#'):
+                continue
+            nodes = line.split()
+            if len(nodes) >= 2:
+                yield nodes[0], nodes[1]
+
+class StreamingGraphMetrics(object):
+    """
+    Metrics of an undirected graph that is given one edge at a time, kept up
+    to date as edges arrive so that they can be queried at any point:
+    the node and edge counts, the degree histogram, the connected components
+    (union-find with union by size and path halving), and an estimate of the
+    number of triangles (TRIEST-IMPR, De Stefani et al. 2016), which keeps a
+    random sample of at most sample_size edges and is exact until more edges
+    than that have arrived.
+    Duplicate edges, in either direction, are ignored as in networkx.Graph,
+    which needs a set of the edges seen; with dedupe=False every edge is
+    assumed new and only the triangle sample is kept.
+    """
+    def __init__(self, sample_size=100000, dedupe=True, seed=None):
+        self.index = {}
+        self.parent = []
+        self.component_size = []
+        self.degree = []
+        self.histogram = Counter()
+        self.components = 0
+        self.largest = 0
+        self.edges = 0
+        self.seen = set() if dedupe else None
+        self.sample_size = sample_size
+        self.sample = []
+        self.sample_adjacency = {}
+        self.triangle_estimate = 0.0
+        self.random = random.Random(seed)
+
+    def node(self, u):
+        i = self.index.get(u)
+        if i is None:
+            i = len(self.parent)
+            self.index[u] = i
+            self.parent.append(i)
+            self.component_size.append(1)
+            self.degree.append(0)
+            self.histogram[0] += 1
+            self.components += 1
+            self.largest = max(self.largest, 1)
+        return i
+
+    def find(self, i):
+        parent = self.parent
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    def union(self, i, j):
+        i, j = self.find(i), self.find(j)
+        if i == j:
+            return
+        if self.component_size[i] < self.component_size[j]:
+            i, j = j, i
+        self.parent[j] = i
+        self.component_size[i] += self.component_size[j]
+        self.components -= 1
+        self.largest = max(self.largest, self.component_size[i])
+
+    def add_degree(self, i, amount):
+        self.histogram[self.degree[i]] -= 1
+        self.degree[i] += amount
+        self.histogram[self.degree[i]] += 1
+
+    def add_edge(self, u, v):
+        i, j = self.node(u), self.node(v)
+        if self.seen is not None:
+            key = (i, j) if i < j else (j, i)
+            if key in self.seen:
+                return
+            self.seen.add(key)
+        self.edges += 1
+        if i == j:
+            # A self-loop counts twice in the degree, as in networkx
+            self.add_degree(i, 2)
+            return
+        self.add_degree(i, 1)
+        self.add_degree(j, 1)
+        self.union(i, j)
+        self.count_triangles(i, j)
+
+    def add_edges_from(self, edges):
+        for u, v in edges:
+            self.add_edge(u, v)
+
+    def read_edgelist(self, path):
+        self.add_edges_from(iter_edgelist(path))
+
+    def count_triangles(self, i, j):
+        """
+        The TRIEST-IMPR update: the triangles the new edge closes in the
+        sample are counted, weighted by the inverse probability that both of
+        their other edges are in the sample, then the edge goes through
+        reservoir sampling.
+        """
+        t, M = self.edges, self.sample_size
+        adjacency = self.sample_adjacency
+        common = len(adjacency.get(i, set()) & adjacency.get(j, set()))
+        if common:
+            weight = max(1.0, (t - 1.0) * (t - 2.0) / (M * (M - 1.0)))
+            self.triangle_estimate += weight * common
+        if len(self.sample) < M:
+            self.sample.append((i, j))
+        elif self.random.random() < M / float(t):
+            slot = self.random.randrange(M)
+            a, b = self.sample[slot]
+            adjacency[a].discard(b)
+            adjacency[b].discard(a)
+            self.sample[slot] = (i, j)
+        else:
+            return
+        adjacency.setdefault(i, set()).add(j)
+        adjacency.setdefault(j, set()).add(i)
+
+    def number_of_nodes(self):
+        return len(self.parent)
+
+    def number_of_edges(self):
+        return self.edges
+
+    def number_connected_components(self):
+        return self.components
+
+    def is_connected(self):
+        return self.components == 1
+
+    def largest_component_size(self):
+        return self.largest
+
+    def connected(self, u, v):
+        return self.find(self.index[u]) == self.find(self.index[v])
+
+    def degree_histogram(self):
+        """
+        Number of nodes of every degree, as returned by nx.degree_histogram.
+        """
+        top = max(degree for degree, count in self.histogram.items() if count) if self.parent else -1
+        return [self.histogram[degree] for degree in range(top + 1)]
+
+    def triangles(self):
+        """
+        The estimated number of triangles, exact while no more than
+        sample_size edges have been added.
+        """
+        return int(round(self.triangle_estimate))
+
+
+def shortest_paths(G, source):
+    """
+    Level-synchronous breadth-first-search from source on a CompactGraph,
+    counting shortest paths. Returns the distance of every node (-1 when
+    unreachable), the number of shortest paths from source to every node,
+    and the edges of the shortest-path DAG, level by level, as a list of
+    (parents, children) arrays.
+    """
+    n = G.number_of_nodes()
+    distance = np.full(n, -1, dtype=np.int64)
+    paths = np.zeros(n)
+    distance[source] = 0
+    paths[source] = 1
+    frontier = np.array([source], dtype=np.int64)
+    levels = []
+    depth = 0
+    while len(frontier):
+        origins, neighbors = expand(G, frontier)
+        unseen = distance[neighbors] == -1
+        distance[neighbors[unseen]] = depth + 1
+        forward = distance[neighbors] == depth + 1
+        origins, neighbors = origins[forward], neighbors[forward]
+        np.add.at(paths, neighbors, paths[origins])
+        levels.append((origins, neighbors))
+        frontier = np.flatnonzero(np.bincount(neighbors, minlength=n))
+        depth += 1
+    return distance, paths, levels
+
+def pivot_task(pivots):
+    """
+    Run a shortest-path search from every pivot on WORKER_GRAPH, and return
+    the sums that estimate_path_metrics needs: Brandes dependencies and
+    distances of every node, how many pivots reached every node, the
+    histogram of distances, and the eccentricity and farthest node of every pivot.
+    """
+    G = WORKER_GRAPH
+    n = G.number_of_nodes()
+    dependency = np.zeros(n)
+    distance_sum = np.zeros(n)
+    reached = np.zeros(n, dtype=np.int64)
+    histogram = np.zeros(1, dtype=np.int64)
+    eccentricities = []
+    for source in pivots:
+        distance, paths, levels = shortest_paths(G, source)
+        delta = np.zeros(n)
+        for parents, children in reversed(levels):
+            np.add.at(delta, parents, paths[parents] / paths[children] * (1 + delta[children]))
+        delta[source] = 0
+        dependency += delta
+        reachable = distance > 0
+        distance_sum[reachable] += distance[reachable]
+        reached[reachable] += 1
+        counts = np.bincount(distance[reachable])
+        if len(counts) > len(histogram):
+            histogram = np.concatenate((histogram, np.zeros(len(counts) - len(histogram), dtype=np.int64)))
+        histogram[:len(counts)] += counts
+        farthest = int(np.argmax(distance))
+        eccentricities.append((int(source), int(distance[farthest]), farthest))
+    return dependency, distance_sum, reached, histogram, eccentricities
+
+def connected_component_labels(G):
+    """
+    Label every node of a CompactGraph with the smallest node id of its
+    connected component, by propagating minimum labels with pointer jumping.
+    """
+    n = G.number_of_nodes()
+    rows = G.rows()
+    labels = np.arange(n)
+    while True:
+        new = labels.copy()
+        np.minimum.at(new, rows, labels[G.indices])
+        new = new[new]
+        if np.array_equal(new, labels):
+            return labels
+        labels = new
+
+def pivots_needed(n, epsilon, delta):
+    """
+    Number of pivots for which every estimated normalized betweenness and
+    average distance (relative to the diameter) is within epsilon of its
+    value with probability at least 1 - delta, by Hoeffding's inequality
+    and a union bound over the n nodes (Eppstein and Wang, 2004).
+    """
+    return int(math.ceil(math.log(2.0 * n / delta) / (2.0 * epsilon ** 2)))
+
+def estimate_path_metrics(G, epsilon=0.05, delta=0.1, pivots=None, time_budget=None,
+                          workers=None, random_state=None, batch=16):
+    """
+    Estimate betweenness and closeness centrality, the diameter, and the
+    distribution of distances of a CompactGraph from shortest-path searches
+    started at randomly sampled pivot nodes, run in parallel on a process
+    pool sharing the graph (see worker_pool).
+    The number of pivots is chosen from the error bound epsilon and the
+    failure probability delta (see pivots_needed), unless given. Searches
+    stop early once time_budget seconds have passed, and the epsilon
+    achieved with the pivots actually used is reported.
+    Returns a dict with:
+      betweenness: normalized like nx.betweenness_centrality
+      closeness: like nx.closeness_centrality, NaN for nodes no pivot reached
+      diameter: (lower, upper) bounds of the diameter of the largest component
+      distance_distribution: fraction of connected pairs at every distance
+      average_distance, effective_diameter (90th percentile of the distances),
+      pivots, epsilon, delta and elapsed seconds.
+    """
+    start = time.perf_counter()
+    n = G.number_of_nodes()
+    rng = np.random.default_rng(random_state)
+    if pivots is None:
+        pivots = pivots_needed(n, epsilon, delta)
+    pivots = min(pivots, n)
+    order = rng.permutation(n)[:pivots]
+    batches = [order[i:i + batch] for i in range(0, pivots, batch)]
+    deadline = start + time_budget if time_budget else None
+    results = []
+    if workers == 1:
+        global WORKER_GRAPH
+        WORKER_GRAPH = G
+        try:
+            for pivot_batch in batches:
+                if deadline and time.perf_counter() > deadline and results:
+                    break
+                results.append((len(pivot_batch), pivot_task(pivot_batch)))
+        finally:
+            WORKER_GRAPH = None
+    else:
+        workers = workers or os.cpu_count()
+        with worker_pool(G, workers) as executor:
+            pending = {}
+            queued = iter(batches)
+            for pivot_batch in queued:
+                pending[executor.submit(pivot_task, pivot_batch)] = len(pivot_batch)
+                if len(pending) >= 2 * workers:
+                    break
+            while pending:
+                timeout = max(deadline - time.perf_counter(), 0) if deadline else None
+                done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+                if not done:
+                    if results:
+                        break
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    results.append((pending.pop(future), future.result()))
+                    if not deadline or time.perf_counter() < deadline:
+                        pivot_batch = next(queued, None)
+                        if pivot_batch is not None:
+                            pending[executor.submit(pivot_task, pivot_batch)] = len(pivot_batch)
+            for future in pending:
+                future.cancel()
+    used = sum(count for count, result in results)
+    dependency = sum(result[0] for count, result in results)
+    distance_sum = sum(result[1] for count, result in results)
+    reached = sum(result[2] for count, result in results)
+    length = max(len(result[3]) for count, result in results)
+    histogram = np.zeros(length, dtype=np.int64)
+    for count, result in results:
+        histogram[:len(result[3])] += result[3]
+    eccentricities = [item for count, result in results for item in result[4]]
+
+    scale = float(n) / used / ((n - 1) * (n - 2)) if n > 2 else 0.0
+    betweenness = dependency * scale
+    labels = connected_component_labels(G)
+    component_size = np.bincount(labels, minlength=n)[labels]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        average = distance_sum / reached
+        closeness = np.where(reached > 0, (component_size - 1.0) / (n - 1) / average, np.nan)
+    closeness[component_size == 1] = 0.0
+
+    largest = np.argmax(np.bincount(labels))
+    in_largest = [(ecc, far) for source, ecc, far in eccentricities if labels[source] == largest]
+    if in_largest:
+        lower = max(ecc for ecc, far in in_largest)
+        upper = 2 * min(ecc for ecc, far in in_largest)
+        # Double sweep: the farthest node from a pivot often has a larger eccentricity
+        far = max(in_largest)[1]
+        lower = max(lower, int(shortest_paths(G, far)[0].max()))
+    else:
+        lower = upper = 0
+    total = histogram[1:].sum()
+    distribution = histogram / float(total) if total else histogram.astype(float)
+    cumulative = np.cumsum(distribution)
+    return {
+        'betweenness': betweenness,
+        'closeness': closeness,
+        'diameter': (lower, max(lower, upper)),
+        'distance_distribution': distribution,
+        'average_distance': float(np.dot(np.arange(len(distribution)), distribution)),
+        'effective_diameter': int(np.searchsorted(cumulative, 0.9)) if total else 0,
+        'pivots': used,
+        'epsilon': math.sqrt(math.log(2.0 * n / delta) / (2.0 * used)),
+        'delta': delta,
+        'elapsed': time.perf_counter() - start,
+    }
@@ -0,0 +1,117 @@
+"""
+Benchmark of prediction_server.py under concurrent load from localhost.
+
+Starts the server in a child process, so that the clients do not compete with
+it for the interpreter lock, then runs a number of client threads, each
+sending GET /predict requests over its own keep-alive connection for a fixed
+duration. Names are drawn from the yob datasets with their popularity, so the
+frequent ones hit the LRU cache. Reports the requests per second and the
+latency percentiles seen by the clients, along with the batching and cache
+statistics of the server, for every max-batch given (1 disables batching).
+
+Usage: python prediction_benchmark.py [--model model.npz] [--clients N] [--duration SECONDS]
+                                      [--max-batch N [N ...]] [--max-wait-ms MS]
+                                      [--cache-size N] [--port P] [--seed S]
+"""
+import argparse
+import http.client
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+from urllib.parse import quote
+
+import numpy as np
+
+import prediction_server
+import utils
+
+
+def client(port, names, deadline, latencies):
+    connection = http.client.HTTPConnection("localhost", port)
+    for name in names:
+        if time.perf_counter() > deadline:
+            break
+        start = time.perf_counter()
+        connection.request("GET", "/predict?name=" + quote(name))
+        response = connection.getresponse()
+        response.read()
+        latencies.append(time.perf_counter() - start)
+    connection.close()
+
+
+def start_server(args, max_batch, timeout=30):
+    """
+    Starts prediction_server.py in a child process and waits until it accepts connections
+    """
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "prediction_server.py")
+    process = subprocess.Popen([sys.executable, script, "serve", "--model", args.model,
+                                "--port", str(args.port), "--max-batch", str(max_batch),
+                                "--max-wait-ms", str(args.max_wait_ms), "--cache-size", str(args.cache_size)],
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + timeout
+    while time.time() < deadline and process.poll() is None:
+        try:
+            socket.create_connection(("localhost", args.port), timeout=1).close()
+            return process
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    process.wait()
+    raise RuntimeError("The server did not start on port %d" % args.port)
+
+
+def run(names, args, max_batch):
+    server = start_server(args, max_batch)
+    port = args.port
+    try:
+        latencies = [[] for _ in range(args.clients)]
+        deadline = time.perf_counter() + args.duration
+        clients = [threading.Thread(target=client, args=(port, names[i::args.clients], deadline, latencies[i]))
+                   for i in range(args.clients)]
+        start = time.perf_counter()
+        for thread in clients:
+            thread.start()
+        for thread in clients:
+            thread.join()
+        elapsed = time.perf_counter() - start
+
+        connection = http.client.HTTPConnection("localhost", port)
+        connection.request("GET", "/metrics")
+        metrics = json.loads(connection.getresponse().read())
+        connection.close()
+    finally:
+        server.terminate()
+        server.wait()
+
+    latencies = np.concatenate(latencies) * 1000
+    print("%-10s %10.1f %10.3f %10.3f %10.3f %10s %10s" % (
+        max_batch, len(latencies) / elapsed, np.percentile(latencies, 50), np.percentile(latencies, 99),
+        latencies.max(), metrics["mean_batch_size"], metrics["cache_hit_ratio"]))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the prediction server under concurrent load.")
+    parser.add_argument("--model", default=prediction_server.DEFAULT_MODEL, help="model file")
+    parser.add_argument("--clients", type=int, default=16, help="concurrent client connections")
+    parser.add_argument("--duration", type=float, default=5, help="seconds of load per configuration")
+    parser.add_argument("--max-batch", type=int, nargs="*", default=[1, 64], help="batch sizes to try")
+    parser.add_argument("--max-wait-ms", type=float, default=2)
+    parser.add_argument("--cache-size", type=int, default=10000)
+    parser.add_argument("--port", type=int, default=8201, help="port of the server")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    dataset = utils.load_names(prediction_server.DEFAULT_DATASETS)
+    totals = dataset.counts.sum(axis=1)
+    rng = np.random.default_rng(args.seed)
+    names = dataset.names[rng.choice(len(dataset), 1000000, p=totals / totals.sum())].tolist()
+
+    print("%d clients, %.1f s per run" % (args.clients, args.duration))
+    print("%-10s %10s %10s %10s %10s %10s %10s" % ("max batch", "req/s", "p50 ms", "p99 ms", "max ms",
+                                                   "mean batch", "cache hits"))
+    for max_batch in args.max_batch:
+        run(names, args, max_batch)
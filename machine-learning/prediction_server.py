@@ -0,0 +1,376 @@
+# Copyright (c) 2016 Yazan Boshmaf
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation
+# files (the "Software"), to deal in the Software without
+# restriction, including without limitation the rights to use,
+# copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following
+# conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+# OTHER DEALINGS IN THE SOFTWARE.
+
+"""
+A local HTTP service predicting the gender of first names.
+
+Train the classifier of the notebook once and save it:
+
+    python prediction_server.py train [--model model.npz]
+
+then serve it:
+
+    python prediction_server.py serve [--model model.npz] [--port 8200]
+                                      [--max-batch 64] [--max-wait-ms 2] [--cache-size 10000]
+
+    GET  /predict?name=Christian      {"name": "Christian", "gender": "male", "female_probability": 0.0202}
+    POST /predict {"names": [...]}    {"predictions": [...]}
+    GET  /metrics                     throughput, latency percentiles, batching and cache statistics
+
+Only training needs scikit-learn. The model is saved as the parameters of the
+Bernoulli naive Bayes classifier and its feature names, so the server loads it
+with NumPy alone. Requests arriving together are grouped into batches of at
+most max-batch names, waiting at most max-wait-ms for more to arrive, and the
+predictions of frequent names are kept in an LRU cache.
+"""
+
+import argparse
+from collections import OrderedDict, deque
+import glob
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import os
+import threading
+import time
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+
+import utils
+
+
+DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_MODEL = os.path.join(DIRECTORY, "model.npz")
+DEFAULT_DATASETS = os.path.join(DIRECTORY, "datasets", "yob*.txt")
+
+
+def train(pattern=DEFAULT_DATASETS, cache_dir=None):
+    """
+    Trains the classifier of the notebook on all the names of the year files
+    matching pattern, and returns it as a NaiveBayesModel
+    """
+    from sklearn.naive_bayes import BernoulliNB
+
+    if not glob.glob(pattern):
+        raise FileNotFoundError("No year files match %s" % pattern)
+    dataset = utils.load_names(pattern, cache_dir)
+    names = dataset.names.tolist()
+    featurizer = utils.NameFeaturizer.fit(names)
+    classifier = BernoulliNB()
+    classifier.fit(featurizer.transform(names), dataset.labels())
+    return NaiveBayesModel(featurizer.feature_names, classifier.classes_,
+                           classifier.feature_log_prob_, classifier.class_log_prior_)
+
+
+class NaiveBayesModel(object):
+    """
+    The parameters of a trained BernoulliNB classifier, and the feature names
+    of its columns. predict_proba computes the same probabilities as
+    BernoulliNB, with NumPy only.
+    """
+
+    def __init__(self, feature_names, classes, feature_log_prob, class_log_prior):
+        self.featurizer = utils.NameFeaturizer(feature_names)
+        self.classes = np.asarray(classes)
+        self.feature_log_prob = np.asarray(feature_log_prob)
+        self.class_log_prior = np.asarray(class_log_prior)
+        negative = np.log(1 - np.exp(self.feature_log_prob))
+        self.weights = (self.feature_log_prob - negative).T
+        self.bias = self.class_log_prior + negative.sum(axis=1)
+
+    def save(self, file_name):
+        np.savez(file_name, feature_names=np.array(self.featurizer.feature_names), classes=self.classes,
+                 feature_log_prob=self.feature_log_prob, class_log_prior=self.class_log_prior)
+
+    @classmethod
+    def load(cls, file_name):
+        data = np.load(file_name)
+        return cls(data["feature_names"].tolist(), data["classes"], data["feature_log_prob"],
+                   data["class_log_prior"])
+
+    def predict_proba(self, names):
+        X = (self.featurizer.transform(names) > 0).astype(np.float64)
+        joint = X @ self.weights + self.bias
+        joint -= joint.max(axis=1)[:, np.newaxis]
+        probabilities = np.exp(joint)
+        return probabilities / probabilities.sum(axis=1)[:, np.newaxis]
+
+    def female_probability(self, names):
+        return self.predict_proba(names)[:, list(self.classes).index(1)]
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q / 100.0 * (len(values) - 1))))]
+
+
+class Metrics(object):
+    """
+    Counters of the server, and the latencies of the most recent requests
+    """
+
+    def __init__(self, window=10000):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.requests = 0
+        self.names = 0
+        self.cache_hits = 0
+        self.batches = 0
+        self.batched_names = 0
+        self.latencies = deque(maxlen=window)
+
+    def request(self, names, latency):
+        with self.lock:
+            self.requests += 1
+            self.names += names
+            self.latencies.append(latency)
+
+    def batch(self, size):
+        with self.lock:
+            self.batches += 1
+            self.batched_names += size
+
+    def hit(self):
+        with self.lock:
+            self.cache_hits += 1
+
+    def to_json(self):
+        with self.lock:
+            latencies = list(self.latencies)
+            elapsed = time.time() - self.started
+            summary = {
+                "uptime_s": round(elapsed, 3),
+                "requests": self.requests,
+                "names": self.names,
+                "requests_per_s": round(self.requests / elapsed, 1),
+                "names_per_s": round(self.names / elapsed, 1),
+                "cache_hits": self.cache_hits,
+                "cache_hit_ratio": round(self.cache_hits / float(self.names), 4) if self.names else None,
+                "batches": self.batches,
+                "mean_batch_size": round(self.batched_names / float(self.batches), 2) if self.batches else None,
+            }
+        for q in (50, 90, 99):
+            value = percentile(latencies, q)
+            summary["latency_p%d_ms" % q] = round(value * 1000, 3) if value is not None else None
+        return summary
+
+
+class PredictionCache(object):
+    """
+    LRU cache of the female probability of names
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+
+    def get(self, name):
+        with self.lock:
+            value = self.entries.get(name)
+            if value is not None:
+                self.entries.move_to_end(name)
+            return value
+
+    def put(self, name, value):
+        if not self.size:
+            return
+        with self.lock:
+            self.entries[name] = value
+            self.entries.move_to_end(name)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+
+class PredictionError(Exception):
+    pass
+
+
+class MicroBatcher(object):
+    """
+    Groups the names asked for by concurrent requests into batches. A thread
+    takes the first pending name, waits at most max_wait seconds for up to
+    max_batch names in total, and predicts them all at once. If the prediction
+    of a batch fails, the requests waiting for it raise PredictionError.
+    """
+
+    def __init__(self, model, metrics, max_batch=64, max_wait=0.002):
+        self.model = model
+        self.metrics = metrics
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.condition = threading.Condition()
+        self.pending = deque()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def predict(self, names):
+        """
+        Returns the female probability of every name, blocking until predicted
+        """
+        slots = [[name, None, threading.Event(), None] for name in names]
+        with self.condition:
+            self.pending.extend(slots)
+            self.condition.notify()
+        for slot in slots:
+            slot[2].wait()
+        for slot in slots:
+            if slot[3] is not None:
+                raise PredictionError(slot[3])
+        return [slot[1] for slot in slots]
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.pending:
+                    self.condition.wait()
+                deadline = time.perf_counter() + self.max_wait
+                while len(self.pending) < self.max_batch:
+                    remaining = deadline - time.perf_counter()
+                    if remaining <= 0:
+                        break
+                    self.condition.wait(remaining)
+                batch = [self.pending.popleft() for _ in range(min(self.max_batch, len(self.pending)))]
+            try:
+                probabilities = self.model.female_probability([slot[0] for slot in batch])
+            except Exception as error:
+                for slot in batch:
+                    slot[3] = repr(error)
+                    slot[2].set()
+                continue
+            self.metrics.batch(len(batch))
+            for slot, probability in zip(batch, probabilities):
+                slot[1] = float(probability)
+                slot[2].set()
+
+
+class PredictionServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, address, model, max_batch=64, max_wait=0.002, cache_size=10000):
+        ThreadingHTTPServer.__init__(self, address, PredictionHandler)
+        self.metrics = Metrics()
+        self.cache = PredictionCache(cache_size)
+        self.batcher = MicroBatcher(model, self.metrics, max_batch, max_wait)
+
+    def predict(self, names):
+        """
+        Returns the predictions of names, from the cache when possible.
+        Raises PredictionError if the model fails, in which case nothing is cached.
+        """
+        probabilities = [self.cache.get(name.lower()) for name in names]
+        missing = [i for i, probability in enumerate(probabilities) if probability is None]
+        for i in range(len(names) - len(missing)):
+            self.metrics.hit()
+        if missing:
+            predicted = self.batcher.predict([names[i] for i in missing])
+            for i, probability in zip(missing, predicted):
+                probabilities[i] = probability
+                self.cache.put(names[i].lower(), probability)
+        return [{"name": name, "gender": "female" if probability > 0.5 else "male",
+                 "female_probability": round(probability, 4)}
+                for name, probability in zip(names, probabilities)]
+
+
+class PredictionHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # The headers and the body are written separately, which would otherwise
+    # wait for the delayed acknowledgement of the client on keep-alive connections
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def reply(self, status, body):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == "/metrics":
+            self.reply(200, self.server.metrics.to_json())
+        elif url.path == "/predict":
+            names = parse_qs(url.query).get("name")
+            if not names or not names[0]:
+                self.reply(400, {"error": "missing name"})
+                return
+            self.answer(names[:1], single=True)
+        else:
+            self.reply(404, {"error": "not found"})
+
+    def do_POST(self):
+        if urlparse(self.path).path != "/predict":
+            self.reply(404, {"error": "not found"})
+            return
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            names = body["names"]
+        except (ValueError, KeyError, TypeError):
+            names = None
+        if not isinstance(names, list) or not all(isinstance(name, str) and name for name in names):
+            self.reply(400, {"error": "expected {\"names\": [...]}, a list of non-empty strings"})
+            return
+        self.answer(names, single=False)
+
+    def answer(self, names, single):
+        start = time.perf_counter()
+        try:
+            predictions = self.server.predict(names)
+        except PredictionError as error:
+            self.reply(500, {"error": "prediction failed: %s" % error})
+            return
+        self.server.metrics.request(len(names), time.perf_counter() - start)
+        self.reply(200, predictions[0] if single else {"predictions": predictions})
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Train or serve the name gender classifier.")
+    parser.add_argument("command", choices=["train", "serve"])
+    parser.add_argument("--model", default=DEFAULT_MODEL, help="model file")
+    parser.add_argument("--datasets", default=DEFAULT_DATASETS, help="year files to train on")
+    parser.add_argument("--port", type=int, default=8200)
+    parser.add_argument("--max-batch", type=int, default=64, help="most names predicted at once")
+    parser.add_argument("--max-wait-ms", type=float, default=2, help="longest wait for a batch to fill up")
+    parser.add_argument("--cache-size", type=int, default=10000, help="names kept in the LRU cache")
+    args = parser.parse_args()
+
+    if args.command == "train":
+        model = train(args.datasets)
+        model.save(args.model)
+        print("Model saved to", args.model)
+    else:
+        model = NaiveBayesModel.load(args.model)
+        server = PredictionServer(("localhost", args.port), model, args.max_batch,
+                                  args.max_wait_ms / 1000.0, args.cache_size)
+        print("Serving predictions on port", args.port)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
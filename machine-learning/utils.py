@@ -22,34 +22,248 @@
 # OTHER DEALINGS IN THE SOFTWARE.
 
 
-import warnings
-warnings.filterwarnings('ignore')
+from concurrent.futures import ProcessPoolExecutor
+import glob
+import json
+import os
+import tempfile
 
-from sklearn.feature_extraction import DictVectorizer
+import numpy as np
+from scipy.sparse import csr_matrix
 
 
-def get_vector(name, feature_names, full_vector):
+def name_features(name):
+    """
+    Returns the features of a name, as in the notebook
+    """
+    name = name.lower()
+    return {"last_letter": name[-1],
+            "last_two": name[-2:],
+            "last_is_vowel": 1 if name[-1] in "aeiouy" else 0}
+
+
+class NameFeaturizer(object):
+    """
+    Turns names into feature vectors whose columns are given by feature_names,
+    named like the ones of DictVectorizer ("last_letter=a", "last_is_vowel").
+    The index from feature name to column is built once, and the columns of
+    every name ending are cached, since the features only depend on the last
+    two letters. Features not in feature_names are ignored.
+    """
+
+    def __init__(self, feature_names):
+        self.feature_names = list(feature_names)
+        self.index = dict((feature, column) for column, feature in enumerate(self.feature_names))
+        self.endings = {}
+
+    @classmethod
+    def fit(cls, names):
+        """
+        Returns a featurizer with a column for every feature of the names,
+        in the sorted order DictVectorizer uses
+        """
+        feature_names = set()
+        for name in names:
+            for feature, value in name_features(name).items():
+                feature_names.add(feature + "=" + value if isinstance(value, str) else feature)
+        return cls(sorted(feature_names))
+
+    def columns(self, name):
+        """
+        Returns the (columns, values) of the non-zero features of a name
+        """
+        ending = name[-2:].lower()
+        cached = self.endings.get(ending)
+        if cached is None:
+            columns, values = [], []
+            for feature, value in sorted(name_features(ending).items()):
+                if isinstance(value, str):
+                    feature, value = feature + "=" + value, 1
+                column = self.index.get(feature)
+                if column is not None and value:
+                    columns.append(column)
+                    values.append(value)
+            cached = self.endings[ending] = (columns, values)
+        return cached
+
+    def transform(self, names):
+        """
+        Returns the feature vectors of a batch of names as a sparse CSR matrix
+        """
+        indptr = [0]
+        indices = []
+        data = []
+        for name in names:
+            columns, values = self.columns(name)
+            indices.extend(columns)
+            data.extend(values)
+            indptr.append(len(indices))
+        return csr_matrix((np.array(data, dtype=np.float64), np.array(indices, dtype=np.int32),
+                           np.array(indptr, dtype=np.int64)), shape=(len(indptr) - 1, len(self.feature_names)))
+
+
+def parse_year(file_name):
+    """
+    Returns the names of the lines of a yob file and their
+    [male_count, female_count] as an array. A name is on two lines when
+    it is given to both genders; merge_counts adds them up.
+    """
+    rows = np.loadtxt(file_name, dtype=[("name", "U32"), ("gender", "U1"), ("count", "i8")],
+                      delimiter=",", ndmin=1)
+    counts = np.zeros((len(rows), 2), dtype=np.int64)
+    counts[np.arange(len(rows)), (rows["gender"] == "F").astype(np.int64)] = rows["count"]
+    return rows["name"], counts
+
+
+def merge_counts(parts):
+    """
+    Merges (names, counts) pairs into sorted lowercased names and their total counts
+    """
+    index = {}
+    positions = np.fromiter((index.setdefault(name.lower(), len(index))
+                             for names, counts in parts for name in names.tolist()), dtype=np.int64)
+    counts = np.concatenate([counts for names, counts in parts])
+    merged = np.empty((len(index), 2), dtype=np.int64)
+    for gender in (0, 1):
+        merged[:, gender] = np.bincount(positions, weights=counts[:, gender], minlength=len(index))
+    names = np.array(list(index), dtype=str)
+    order = np.argsort(names)
+    return names[order], merged[order]
+
+
+class NameCounts(object):
+    """
+    The number of males and females given each name, as a sorted array of names
+    and an (n, 2) array of [male_count, female_count], in the same order
     """
-    Returns a complete feature vector
+
+    def __init__(self, names, counts):
+        self.names = names
+        self.counts = counts
+
+    def __len__(self):
+        return len(self.names)
+
+    def index(self, name):
+        position = int(np.searchsorted(self.names, name.lower()))
+        if position == len(self.names) or self.names[position] != name.lower():
+            raise KeyError(name)
+        return position
+
+    def get(self, name):
+        return self.counts[self.index(name)]
+
+    def labels(self):
+        """
+        Returns 1 for the names which are female more than half of the time, else 0
+        """
+        return (self.counts[:, 1] * 2 > self.counts.sum(axis=1)).astype(np.int64)
+
+    def unisex_count(self):
+        return int(np.count_nonzero(self.counts.min(axis=1)))
+
+
+def file_stamp(file_name):
+    stat = os.stat(file_name)
+    return [stat.st_size, stat.st_mtime]
+
+
+def load_names(pattern="datasets/yob*.txt", cache_dir=None, workers=None):
+    """
+    Loads the yob files matching pattern into NameCounts, parsing the files in
+    parallel. With a cache_dir, the arrays are saved there along with a manifest
+    of the files they include, and are memory-mapped by later calls. When files
+    are added, only the new ones are parsed and merged into the cache; when a
+    file changes or is removed, everything is parsed again.
     """
-    name_features = {}
-    name_features["last_letter"] = name[-1]
-    name_features["last_two"] = name[-2:]
-    name_features["last_is_vowel"] = 0 if name[-1] in "aeiouy" else 0
+    file_names = sorted(glob.glob(pattern))
+    stamps = dict((os.path.basename(file_name), file_stamp(file_name)) for file_name in file_names)
+    cached = None
+    if cache_dir:
+        try:
+            with open(os.path.join(cache_dir, "manifest.json")) as manifest:
+                manifest = json.load(manifest)
+            included = manifest["files"]
+            if all(stamps.get(name) == stamp for name, stamp in included.items()):
+                cached = NameCounts(np.load(os.path.join(cache_dir, manifest["names"]), mmap_mode="r"),
+                                    np.load(os.path.join(cache_dir, manifest["counts"]), mmap_mode="r"))
+                file_names = [file_name for file_name in file_names
+                              if os.path.basename(file_name) not in included]
+        except (IOError, OSError, ValueError, KeyError, TypeError):
+            pass
+    if cached is not None and not file_names:
+        return cached
 
-    vectorizer = DictVectorizer()
-    small_vector = vectorizer.fit_transform(name_features).toarray()[0]
-    small_feature_names = vectorizer.get_feature_names()
+    if len(file_names) > 1 and workers != 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            parts = list(executor.map(parse_year, file_names))
+    else:
+        parts = [parse_year(file_name) for file_name in file_names]
+    if cached is not None:
+        parts.append((np.asarray(cached.names), np.asarray(cached.counts)))
+    if not parts:
+        return NameCounts(np.array([], dtype=str), np.zeros((0, 2), dtype=np.int64))
+    result = NameCounts(*merge_counts(parts))
+
+    if cache_dir:
+        save_cache(cache_dir, result, stamps)
+    return result
+
+
+def save_cache(cache_dir, counts, stamps):
+    """
+    Saves NameCounts into cache_dir, for load_names. The arrays are written to
+    new files, which the manifest names, and the manifest is replaced
+    atomically last, so an interrupted save leaves the previous cache intact,
+    and arrays still memory-mapped by earlier NameCounts are never overwritten.
+    """
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    manifest = {"files": stamps}
+    for key, array in (("names", counts.names), ("counts", counts.counts)):
+        with tempfile.NamedTemporaryFile(dir=cache_dir, prefix=key + "-", suffix=".npy", delete=False) as f:
+            np.save(f, array)
+        manifest[key] = os.path.basename(f.name)
+    manifest_path = os.path.join(cache_dir, "manifest.json")
+    with tempfile.NamedTemporaryFile("w", dir=cache_dir, prefix="manifest-", suffix=".json", delete=False) as f:
+        json.dump(manifest, f)
+    try:
+        os.replace(f.name, manifest_path)
+    except BaseException:
+        os.remove(f.name)
+        raise
+    # Remove the arrays of earlier saves; open memory maps keep their data
+    for file_name in glob.glob(os.path.join(cache_dir, "*.npy")):
+        if os.path.basename(file_name) not in (manifest["names"], manifest["counts"]):
+            try:
+                os.remove(file_name)
+            except OSError:
+                pass
+
+
+# The featurizer of the last feature_names given to get_vector, with that object and its length
+last_featurizer = (None, 0, None)
+
+def get_vector(name, feature_names, full_vector):
+    """
+    Returns a complete feature vector. feature_names is either a list of
+    feature names or a NameFeaturizer; in the first case, the featurizer is
+    only built again when a different list, or a list of another length, is given.
+    """
+    global last_featurizer
+    if isinstance(feature_names, NameFeaturizer):
+        featurizer = feature_names
+        feature_names = featurizer.feature_names
+    else:
+        names, length, featurizer = last_featurizer
+        if names is not feature_names or length != len(feature_names):
+            featurizer = NameFeaturizer(feature_names)
+            last_featurizer = (feature_names, len(feature_names), featurizer)
 
-    hit_count = 0
-    for index, feature_name in enumerate(feature_names):
-        if feature_name in small_feature_names:
-            full_vector[index] = small_vector[small_feature_names.index(feature_name)]
-            hit_count += 1
-        else:
-            full_vector[index] = 0
+    columns, values = featurizer.columns(name)
+    full_vector[:] = 0
+    full_vector[columns] = values
 
-    assert hit_count == len(small_feature_names) == small_vector.shape[0]
     assert full_vector.shape[0] == len(feature_names)
 
     return full_vector
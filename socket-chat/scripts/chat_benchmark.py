@@ -0,0 +1,138 @@
+"""
+   This script compares the chat server engines under load.
+
+   For every engine it starts the server script in a child process,
+   opens many idle client connections to it, and reports how many
+   connections the server holds, how much memory it uses, and how long
+   a broadcast takes to reach every connected client.
+
+   With --slow N, another N clients connect with a tiny receive buffer and never
+   read, to check that stalled readers do not hold up the rest of the chatroom.
+   The queue statistics reported by the server ("/stats") are printed as well.
+
+   Usage: python chat_benchmark.py [--clients N] [--slow N] [--size BYTES] [--rounds R] [--port P] [engine ...]
+   where engine is one of "threaded" (chat_server.py), "event" (event_server.py)
+   or "sharded" (sharded_server.py, one worker per core).
+   To drive a server with a steady stream of messages, see load_generator.py.
+"""
+import argparse, json, selectors, time
+
+import framing
+from event_server import raise_file_limit
+from load_generator import start_server, stop_server, process_stats, open_clients, drain, ms
+from outbound import percentile
+
+#The engines to compare (see load_generator.ENGINES for their scripts)
+ENGINES = ['threaded', 'event', 'sharded']
+
+#This function sends one message from the first client and measures,
+#for every other client, the time until the message arrives.
+def broadcast_round(clients, token, timeout=30):
+    sender, receivers = clients[0], clients[1:]
+    selector = selectors.DefaultSelector()
+    pending = {}
+    for receiver in receivers:
+        selector.register(receiver, selectors.EVENT_READ)
+        pending[receiver] = bytearray()
+    latencies = []
+    start = time.perf_counter()
+    sender.sendall(framing.encode(token))
+    deadline = start + timeout
+    while pending and time.perf_counter() < deadline:
+        for key, mask in selector.select(timeout=1):
+            receiver = key.fileobj
+            try:
+                data = receiver.recv(65536)
+            except (BlockingIOError, InterruptedError):
+                continue
+            if not data:
+                selector.unregister(receiver)
+                del pending[receiver]
+                continue
+            pending[receiver] += data
+            if token in pending[receiver]:
+                latencies.append(time.perf_counter() - start)
+                selector.unregister(receiver)
+                del pending[receiver]
+    selector.close()
+    return latencies, len(pending)
+
+#This function asks the server for its queue statistics
+def server_stats(client, timeout=5):
+    client.setblocking(True)
+    client.settimeout(timeout)
+    framing.send_frames(client, [b"/stats"])
+    reader = framing.FrameReader()
+    try:
+        while True:
+            payload = framing.recv_frame(client, reader)
+            if payload is None:
+                return {}
+            if payload.startswith(b'{"'):
+                return json.loads(payload.decode("utf-8"))
+    except (OSError, ValueError):
+        return {}
+
+def run(engine, port, n_clients, n_slow, size, rounds):
+    process = start_server(engine, port)
+    try:
+        idle = process_stats(process.pid)
+        clients, connect_times = open_clients(port, n_clients)
+        clients = drain(clients)
+        slow_clients, _ = open_clients(port, n_slow, rcvbuf=4096)
+        loaded = process_stats(process.pid)
+        last_arrivals, all_latencies, missed = [], [], 0
+        for i in range(rounds):
+            if len(clients) < 2:
+                break
+            token = ("#round-%d#" % i).encode("utf-8")
+            latencies, lost = broadcast_round(clients, token.rjust(size, b"."))
+            missed += lost
+            all_latencies += latencies
+            if latencies:
+                last_arrivals.append(max(latencies))
+        queue_stats = server_stats(clients[0]) if clients else {}
+        for client in clients + slow_clients:
+            client.close()
+    finally:
+        stop_server(process)
+    return {
+        'engine': engine,
+        'connections_requested': n_clients,
+        'connections_held': len(clients),
+        'connect_p50_ms': ms(percentile(connect_times, 50)),
+        'connect_p99_ms': ms(percentile(connect_times, 99)),
+        'idle_rss_kb': idle['rss_kb'],
+        'loaded_rss_kb': loaded['rss_kb'],
+        'threads': loaded['threads'],
+        'delivery_p50_ms': ms(percentile(all_latencies, 50)),
+        'delivery_p99_ms': ms(percentile(all_latencies, 99)),
+        'broadcast_p50_ms': ms(percentile(last_arrivals, 50)),
+        'broadcast_max_ms': ms(max(last_arrivals) if last_arrivals else None),
+        'missed_deliveries': missed,
+        'slow_clients': n_slow,
+        'server_evictions': queue_stats.get('evictions'),
+        'server_msgs_per_send': queue_stats.get('messages_per_send'),
+        'server_depth_p99_bytes': queue_stats.get('depth_p99_bytes'),
+        'server_latency_p50_ms': queue_stats.get('latency_p50_ms'),
+        'server_latency_p99_ms': queue_stats.get('latency_p99_ms'),
+    }
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compare chat server engines under load.")
+    parser.add_argument('engines', nargs='*', default=sorted(ENGINES),
+                        help="engines to compare: "+", ".join(sorted(ENGINES)))
+    parser.add_argument('--clients', type=int, default=1000)
+    parser.add_argument('--slow', type=int, default=0)
+    parser.add_argument('--size', type=int, default=64)
+    parser.add_argument('--rounds', type=int, default=20)
+    parser.add_argument('--port', type=int, default=8101)
+    args = parser.parse_args()
+    for engine in args.engines:
+        if engine not in ENGINES:
+            parser.error("unknown engine "+engine)
+
+    raise_file_limit()
+    results = [run(engine, args.port, args.clients, args.slow, args.size, args.rounds) for engine in args.engines]
+    for key in results[0]:
+        print("%-22s" % key + "".join("%16s" % result[key] for result in results))
@@ -1,67 +1,48 @@
 """
-   This is the final version of the chat server application.
-   
+   This is the final version of the chat client application.
+
    Just like the previous version of the script,
    the main thread is used for capturing user input and sending it to the chat server,
    and the child thread is used for receiving messages from the server and displaying it.
-   
+
    The end-user can type the command "\q" to exit the program.
-   There is an extra method terminate() in the ReceiveHandler class, to safely close the thread. 
-"""
-import socket, threading
+   The child thread is a ChatLoop (see chat_connection.py): instead of polling the socket
+   over and over, it sleeps until a message arrives, so an idle client uses no CPU.
+   Its terminate() method wakes it up and safely closes the thread.
 
-#Create socket and connect to the server
-client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-client.connect(('localhost', 8100))
+   Messages are exchanged as length-prefixed frames (see framing.py).
+"""
+from chat_connection import ChatLoop
 
-#Receive the greeting from server upon successful connection
-greeting = client.recv(256) #receive greetings
-print(greeting.decode('utf-8'))
-print('Type \q to exit chat program')
+#This function displays a message received from the server
+def show(connection, message):
+    print(message.decode('utf-8', 'replace'))
 
-#This class wraps the child thread process.
-#The client's socket object is passed through the init arguments
-class ReceiveHandler(threading.Thread):
-    def __init__(self, socket):
-        threading.Thread.__init__(self)
-        self.socket = socket
-    
-    #This method sets the instance attribute self.running to False
-    #which is a terminate condition for the loop inside run() method.
-    def terminate(self):
-        self.running = False
-    
-    #This method wraps the routine to be run on the thread.
-    #It waits to receive a message, and displays it upon receiving.
-    #For safely breaking the while loop we use an instance attribute
-    #self.running as the loop condition. The terminate() method sets
-    #this attribute to False, thus safely exiting the loop
-    def run(self):
-        self.socket.setblocking(0)
-        self.running = True
-        while self.running:
-            try:
-                message = self.socket.recv(256)
-                if not message:
-                    continue
-                print(message.decode('utf-8'))
-            except BlockingIOError:
-                continue
-        print("shutting down receive handler...")
+#This function is called when the server closes the connection
+def closed(connection):
+    print("connection closed by the server, press enter to exit")
 
-#Start the receive routine on a thread
-receive_handler = ReceiveHandler(client)
-receive_handler.start()
+#Start the receive loop on a thread and connect to the server.
+#The greeting from the server is the first message displayed.
+receive_loop = ChatLoop()
+receive_loop.start()
+connection = receive_loop.connect('localhost', 8100, on_message=show, on_close=closed)
+print('Type \\q to exit chat program')
 
 #Maintain connection with the server and prompt the user for messages to send.
 while True:
-    user_input = input('').encode('utf-8')
-    if user_input == b'\q':
+    try:
+        user_input = input('')
+    except EOFError:
+        break
+    if user_input == '\\q':
+        break
+    try:
+        connection.send(user_input)
+    except ConnectionError:
         break
-    client.sendall(user_input)
 
 #If user types \q the loop will break, and the code below will be run.
-#Terminate the child thread and then close the socket.
-receive_handler.terminate()
-client.close()
-print("bye bye")
\ No newline at end of file
+#Terminate the child thread, which also closes the socket.
+receive_loop.terminate()
+print("bye bye")
@@ -0,0 +1,198 @@
+"""
+   This module is a small client library for the chat server.
+
+   A ChatLoop is a thread that serves any number of ChatConnections at once.
+   It sleeps in the selector until one of the sockets has something to read or
+   write, so an idle client costs no CPU, and hundreds of bots can run in one
+   process. Messages are exchanged as frames (see framing.py).
+
+   A connection can hand every message it receives to a callback, or keep them
+   in a queue for receive(). send() can be called from any thread.
+
+   Example:
+
+      loop = ChatLoop()
+      loop.start()
+      connection = loop.connect('localhost', 8100)
+      print(connection.receive(timeout=5))   #the greeting
+      connection.send("hello")
+      loop.terminate()
+"""
+import queue, selectors, socket, threading
+
+import framing
+
+#This class is one connection to the chat server
+class ChatConnection():
+    def __init__(self, loop, client_socket, on_message=None, on_close=None):
+        self.loop = loop
+        self.socket = client_socket
+        self.on_message = on_message
+        self.on_close = on_close
+        self.reader = framing.FrameReader(capacity=4096)
+        self.inbox = queue.Queue()
+        self.outbox = []
+        self.lock = threading.Lock()
+        self.closed = False
+
+    #This method queues a message (str or bytes) and wakes the loop up to send it
+    def send(self, message):
+        if isinstance(message, str):
+            message = message.encode('utf-8')
+        with self.lock:
+            if self.closed:
+                raise ConnectionError("Connection is closed")
+            self.outbox.append(framing.encode(message))
+        self.loop.wake(self)
+
+    #This method returns the next message received, or None once the connection
+    #is closed. It raises queue.Empty if nothing arrives within the timeout.
+    #Only used when there is no on_message callback.
+    def receive(self, timeout=None):
+        return self.inbox.get(timeout=timeout)
+
+    def close(self):
+        self.loop.close(self)
+
+    #Called by the loop for every message received
+    def received(self, message):
+        if self.on_message:
+            self.on_message(self, message)
+        else:
+            self.inbox.put(message)
+
+#This class wraps the thread that runs the selector of all the connections.
+#Other threads talk to it by writing a byte to self.waker, which wakes it up.
+class ChatLoop(threading.Thread):
+    def __init__(self):
+        threading.Thread.__init__(self, daemon=True)
+        self.selector = selectors.DefaultSelector()
+        self.wakeup, self.waker = socket.socketpair()
+        self.wakeup.setblocking(False)
+        self.waker.setblocking(False)
+        self.selector.register(self.wakeup, selectors.EVENT_READ)
+        self.lock = threading.Lock()
+        self.added, self.writable, self.closing = [], set(), set()
+        self.connections = set()
+        self.running = True
+
+    #This method connects to the server and returns the new connection.
+    #The connection is handed over to the loop, which does all the reading.
+    def connect(self, host='localhost', port=8100, on_message=None, on_close=None):
+        client_socket = socket.create_connection((host, port))
+        client_socket.setblocking(False)
+        connection = ChatConnection(self, client_socket, on_message, on_close)
+        with self.lock:
+            self.added.append(connection)
+        self.wake()
+        return connection
+
+    def wake(self, connection=None):
+        with self.lock:
+            if connection is not None:
+                self.writable.add(connection)
+        try:
+            self.waker.send(b'\0')
+        except (BlockingIOError, InterruptedError):
+            pass
+
+    def close(self, connection):
+        with self.lock:
+            self.closing.add(connection)
+        self.wake()
+
+    #This method stops the loop and closes all the connections
+    def terminate(self):
+        self.running = False
+        self.wake()
+        if threading.current_thread() is not self:
+            self.join()
+
+    def run(self):
+        while self.running:
+            self.apply_requests()
+            for key, mask in self.selector.select():
+                if key.fileobj is self.wakeup:
+                    try:
+                        while self.wakeup.recv(4096):
+                            pass
+                    except (BlockingIOError, InterruptedError):
+                        pass
+                    continue
+                connection = key.data
+                if mask & selectors.EVENT_WRITE:
+                    self.flush(connection)
+                if mask & selectors.EVENT_READ and connection in self.connections:
+                    self.read(connection)
+        for connection in list(self.connections):
+            self.drop(connection, notify=False)
+        self.selector.close()
+        self.wakeup.close()
+        self.waker.close()
+
+    #This method applies what the other threads asked for since the last pass
+    def apply_requests(self):
+        with self.lock:
+            added, self.added = self.added, []
+            writable, self.writable = self.writable, set()
+            closing, self.closing = self.closing, set()
+        for connection in added:
+            self.connections.add(connection)
+            self.selector.register(connection.socket, selectors.EVENT_READ, connection)
+        for connection in writable:
+            if connection in self.connections:
+                self.flush(connection)
+        for connection in closing:
+            self.drop(connection)
+
+    def read(self, connection):
+        try:
+            received = connection.reader.recv_into(connection.socket)
+            messages = list(connection.reader.frames())
+        except (BlockingIOError, InterruptedError):
+            return
+        except (OSError, framing.FrameError):
+            received, messages = 0, []
+        for message in messages:
+            connection.received(message)
+        if not received:
+            self.drop(connection)
+
+    def flush(self, connection):
+        with connection.lock:
+            buffers = connection.outbox
+            if not buffers:
+                return
+            try:
+                sent = framing.send_buffers(connection.socket, buffers)
+            except (BlockingIOError, InterruptedError):
+                sent = 0
+            except OSError:
+                sent = None
+            if sent is not None:
+                while buffers and sent >= len(buffers[0]):
+                    sent -= len(buffers.pop(0))
+                if sent:
+                    buffers[0] = buffers[0][sent:]
+            pending = bool(buffers)
+        if sent is None:
+            self.drop(connection)
+            return
+        events = selectors.EVENT_READ | selectors.EVENT_WRITE if pending else selectors.EVENT_READ
+        if self.selector.get_key(connection.socket).events != events:
+            self.selector.modify(connection.socket, events, connection)
+
+    #This method closes a connection. Unless the loop itself is shutting down,
+    #on_close is called, or None is queued to tell receive() about it.
+    def drop(self, connection, notify=True):
+        if connection not in self.connections:
+            return
+        self.connections.discard(connection)
+        with connection.lock:
+            connection.closed = True
+        self.selector.unregister(connection.socket)
+        connection.socket.close()
+        if notify and connection.on_close:
+            connection.on_close(connection)
+        else:
+            connection.inbox.put(None)
@@ -7,9 +7,27 @@
    it maintains connection with multiple clients by using threads.
    It keeps a list of clients and upon receiving a message from one of the clients
    in the list, it will broadcast the message to all the other clients in the list.
+
+   Broadcasting does not send to the other clients directly. Every client has a
+   second thread, the ClientWriter, which drains a bounded queue of outgoing
+   messages (see outbound.py), so a client that stops reading cannot block the
+   sender. A client that falls too far behind is disconnected.
+   Sending "/stats" returns the queue depth and latency statistics.
+
+   Messages are exchanged as length-prefixed frames (see framing.py).
+   Clients can move between chat rooms (see rooms.py), and messages are only
+   broadcast to the members of the sender's room. The last messages of every
+   room are replayed to the clients joining it, and can be written to a log
+   directory (see history.py).
+
+   Usage: python chat_server.py [port] [log_dir]
 """
 import socket, threading, sys, random, string
 
+import framing, rooms
+from history import HistoryStore, REPLAY
+from outbound import OutboundQueue, QueueStats
+
 #This function creates a random string of length 8
 def randname():
     return ''.join(random.SystemRandom().choice(string.ascii_letters) for _ in range(8))
@@ -18,12 +36,57 @@ def randname():
 server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
 
 #Bind to an address and start listening to maximum 5 connections
-server.bind(('', 8100))
+port = int(sys.argv[1]) if len(sys.argv) > 1 else 8100
+server.bind(('', port))
 server.listen(5)
 print("Starting Socket Server")
 
-#Create an empty list of clients
-clients = []
+#Create an empty registry of clients in rooms, the statistics shared by their queues,
+#and the history of the messages of every room
+clients = rooms.RoomRegistry()
+stats = QueueStats()
+history = HistoryStore(log_dir=sys.argv[2] if len(sys.argv) > 2 else None)
+
+#This class wraps the thread that sends messages to one client.
+#Other threads hand it messages through deliver(), which only appends to the
+#client's queue and wakes the writer up; the writer sends everything queued so
+#far in one gather write.
+class ClientWriter(threading.Thread):
+    def __init__(self, client_socket):
+        threading.Thread.__init__(self, daemon=True)
+        self.socket = client_socket
+        self.queue = OutboundQueue(stats)
+        self.condition = threading.Condition()
+        self.running = True
+
+    #This method queues an encoded frame.
+    #It returns False if the client has fallen too far behind.
+    def deliver(self, frame):
+        with self.condition:
+            if not self.queue.push(frame):
+                return False
+            self.condition.notify()
+        return True
+
+    def terminate(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while self.running and not len(self.queue):
+                    self.condition.wait()
+                if not self.running:
+                    break
+                buffers = self.queue.buffers()
+            try:
+                framing.sendall_buffers(self.socket, buffers)
+            except OSError:
+                break
+            with self.condition:
+                self.queue.consume(sum(len(buffer) for buffer in buffers))
 
 #This class wraps the child thread process.
 #Thread-specific information such as the client's socket object and the address are passed through the init arguments
@@ -32,34 +95,90 @@ class ClientHandler(threading.Thread):
     def __init__(self, client_socket, client_address):
         threading.Thread.__init__(self)
         self.socket = client_socket
+        self.key = client_socket.fileno()
         self.address = client_address
         self.name = randname()
-        
+        self.writer = ClientWriter(client_socket)
+        self.reader = framing.FrameReader(capacity=4096)
+
+    #This method disconnects a client that has fallen too far behind.
+    #Shutting the socket down wakes up both its reader and its writer thread.
+    def evict(self):
+        stats.evicted()
+        print(str(self.name)+" is too slow, disconnecting.")
+        try:
+            self.socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
     #This method wraps the routine to be run on the thread.
-    #It sends a greeting message along with a list of online users, and then waits to receive
-    #messages from the client, broadcasting the message upon receiving.
+    #It puts the client in the lobby and sends a greeting message along with a list of online
+    #users in the lobby and its last messages, and then waits to receive messages from the client, broadcasting
+    #the message upon receiving.
     def run(self):
-        clients.append(self)
+        self.writer.start()
+        clients.join(self.key, self, rooms.LOBBY)
         print("Client "+self.name+" joined from "+str(self.address[0])+":"+str(self.address[1]))
-        msg = "--------------------------\nList of Clients:\n--------------------------\n"
-        for client in clients:
-            if client == self:
-                msg += client.name+" (YOU)\n"
-            else:
-                msg += client.name+"\n"
-        msg += "--------------------------\n"
-        self.socket.sendall(b"Welcome to the server\n"+msg.encode("utf-8"))
-        while True:
-            message = self.socket.recv(256)
-            if not message:
-                break
-            print(self.name+" : "+message.decode("utf-8"))
-            for client in clients:
-                if not client == self:
-                    client.socket.sendall(self.name.encode("utf-8")+b" : "+message)
-        self.socket.close()
-        clients.remove(self)
-        print(str(self.name)+" was dropped.")
+        msg = rooms.member_list([client.name for client in clients.members(rooms.LOBBY)], self.name)
+        self.writer.deliver(framing.encode(b"Welcome to the server\n"+msg.encode("utf-8")))
+        self.replay(rooms.LOBBY)
+        try:
+            while True:
+                try:
+                    if not self.reader.recv_into(self.socket):
+                        break
+                    messages = list(self.reader.frames())
+                except (OSError, framing.FrameError):
+                    break
+                for message in messages:
+                    self.handle(message)
+        finally:
+            clients.leave(self.key)
+            self.writer.terminate()
+            self.socket.close()
+            print(str(self.name)+" was dropped.")
+
+    #This method handles one message received from the client
+    def handle(self, message):
+        if message.strip() == b"/stats":
+            self.writer.deliver(framing.encode(stats.to_json().encode("utf-8")))
+            return
+        command = rooms.parse_command(message)
+        if command:
+            self.command(*command)
+            return
+        print(self.name+" : "+message.decode("utf-8", "replace"))
+        frame = framing.encode(self.name.encode("utf-8")+b" : "+message)
+        room = clients.room_of(self.key)
+        history.record(room, frame)
+        for client in clients.members(room):
+            if not client == self:
+                if not client.writer.deliver(frame):
+                    client.evict()
+
+    #This method runs one of the room commands
+    def command(self, command, argument):
+        if command == '/rooms':
+            self.writer.deliver(framing.encode(rooms.room_list(clients.counts()).encode("utf-8")))
+            return
+        if command == '/history':
+            self.replay(clients.room_of(self.key), int(argument) if argument.isdigit() else REPLAY)
+            return
+        room = rooms.LOBBY if command == '/leave' else rooms.room_name(argument)
+        if room is None:
+            self.writer.deliver(framing.encode(b"Usage: /join <room>"))
+            return
+        clients.join(self.key, self, room)
+        msg = rooms.member_list([client.name for client in clients.members(room)], self.name, "Room "+room)
+        self.writer.deliver(framing.encode(msg.encode("utf-8")))
+        self.replay(room)
+
+    #This method sends the last n messages of a room to the client, all in one buffer.
+    #The history is only locked while the frames are picked up, not while they are sent.
+    def replay(self, room, n=REPLAY):
+        frames = history.replay(room, n)
+        if frames and not self.writer.deliver(frames):
+            self.evict()
 
 #Keep listening to incoming connection requests
 #and start the thread upon accepting the connection
@@ -0,0 +1,278 @@
+"""
+   This is an event-driven version of the chat server application.
+   It behaves exactly like chat_server.py: every client is greeted with
+   the list of online users, gets a random name of length 8, and whatever
+   it sends is broadcast to all the other clients.
+
+   Instead of starting one thread per client, a single thread waits on all
+   the sockets at once using the selectors module, and only touches a socket
+   when the operating system reports that it is ready. This lets one process
+   hold tens of thousands of idle connections.
+
+   A client that stops reading never blocks the others: its messages wait in
+   a bounded queue (see outbound.py) and it is disconnected if it falls too far
+   behind. Sending "/stats" returns the queue depth and latency statistics.
+
+   Messages are exchanged as length-prefixed frames (see framing.py).
+   Clients can move between chat rooms (see rooms.py), and messages are only
+   broadcast to the members of the sender's room. The last messages of every
+   room are kept (see history.py) and replayed to the clients joining it; if a
+   log directory is given they are also written to disk, so "/history <n>" can
+   go further back than what is kept in memory.
+
+   Usage: python event_server.py [port] [log_dir]
+"""
+import selectors, socket, sys, random, string
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+import framing, rooms
+from history import HistoryStore, REPLAY
+from outbound import OutboundQueue, QueueStats
+
+#This function creates a random string of length 8
+def randname():
+    return ''.join(random.SystemRandom().choice(string.ascii_letters) for _ in range(8))
+
+#Every open connection needs a file descriptor, so lift the soft limit
+#of open files up to the hard limit allowed for this process.
+def raise_file_limit():
+    if resource is None:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    target = 1048576 if hard == resource.RLIM_INFINITY else hard
+    if soft != resource.RLIM_INFINITY and soft < target:
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (target, hard))
+        except (ValueError, OSError):
+            pass
+
+#This class keeps the state of one connected client.
+#Messages that could not be sent yet wait in its outbound queue until
+#the socket becomes writable again.
+class ClientConnection():
+    def __init__(self, client_socket, client_address, stats=None):
+        self.socket = client_socket
+        self.key = client_socket.fileno()
+        self.address = client_address
+        self.name = randname()
+        self.queue = OutboundQueue(stats)
+        self.reader = framing.FrameReader(capacity=4096)
+
+#This class wraps the event loop of the server.
+#The listening socket and all the client sockets are registered with one
+#selector, and the callback stored with each socket is called when it is ready.
+#Messages are only queued while handling events; all the queues touched during
+#one pass of the loop are then flushed together, so that several pending
+#messages go out to a client in a single send.
+class ChatServer():
+    def __init__(self, host='', port=8100, backlog=1024, reuse_port=False, history=None):
+        self.selector = selectors.DefaultSelector()
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if reuse_port:
+            #Let several processes listen on the same port, the kernel spreads
+            #incoming connections between them (Linux 3.9+, BSD)
+            self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        self.server.bind((host, port))
+        self.server.listen(backlog)
+        self.server.setblocking(False)
+        self.selector.register(self.server, selectors.EVENT_READ, self.accept)
+        self.clients = {}
+        self.rooms = rooms.RoomRegistry()
+        self.history = history if history is not None else HistoryStore()
+        self.dirty = set()
+        self.stats = QueueStats()
+        self.running = False
+
+    #This method accepts every pending connection request, since a single
+    #readiness event on the listening socket can stand for many of them.
+    def accept(self, server_socket, mask):
+        while True:
+            try:
+                (client_socket, address) = server_socket.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as error:
+                #Out of file descriptors, try again on the next event
+                print("Cannot accept client: "+str(error))
+                return
+            client_socket.setblocking(False)
+            client = ClientConnection(client_socket, address, self.stats)
+            self.clients[client.key] = client
+            self.selector.register(client_socket, selectors.EVENT_READ, self.handle)
+            self.join(client)
+
+    #This method puts a new client in the lobby, and sends the greeting message
+    #along with the list of online users in the lobby and its last messages.
+    def join(self, client):
+        print("Client "+client.name+" joined from "+str(client.address[0])+":"+str(client.address[1]))
+        self.rooms.join(client.key, client, rooms.LOBBY)
+        msg = rooms.member_list(self.names(rooms.LOBBY), client.name)
+        self.send(client, framing.encode(b"Welcome to the server\n"+msg.encode("utf-8")))
+        self.replay(client, rooms.LOBBY)
+
+    #This method moves a client to another room, and sends it the list of the room's
+    #members and its last messages
+    def move(self, client, room):
+        self.rooms.join(client.key, client, room)
+        msg = rooms.member_list(self.names(room), client.name, "Room "+room)
+        self.send(client, framing.encode(msg.encode("utf-8")))
+        self.replay(client, room)
+
+    #This method queues the last n messages of a room for the client, all in one buffer
+    def replay(self, client, room, n=REPLAY):
+        frames = self.history.replay(room, n)
+        if frames and self.clients.get(client.key) is client:
+            self.send(client, frames)
+
+    #This method returns the names of the online users in a room
+    def names(self, room):
+        return [client.name for client in self.rooms.members(room)]
+
+    #This method returns the number of online users in every room
+    def room_counts(self):
+        return self.rooms.counts()
+
+    #This method is the callback of every client socket.
+    #It drains the queue when the socket is writable and
+    #reads the next message when the socket is readable.
+    def handle(self, client_socket, mask):
+        client = self.clients.get(client_socket.fileno())
+        if client is None:
+            return
+        if mask & selectors.EVENT_WRITE:
+            self.flush(client)
+        if mask & selectors.EVENT_READ and self.clients.get(client.key) is client:
+            self.read(client)
+
+    #This method receives whatever has arrived and handles every complete message
+    def read(self, client):
+        try:
+            received = client.reader.recv_into(client.socket)
+            messages = list(client.reader.frames())
+        except (BlockingIOError, InterruptedError):
+            return
+        except (OSError, framing.FrameError):
+            received, messages = 0, []
+        for message in messages:
+            if self.clients.get(client.key) is not client:
+                return
+            self.message(client, message)
+        if not received:
+            self.drop(client)
+
+    def message(self, client, message):
+        if message.strip() == b"/stats":
+            self.send(client, framing.encode(self.stats.to_json().encode("utf-8")))
+            return
+        command = rooms.parse_command(message)
+        if command:
+            self.command(client, *command)
+            return
+        print(client.name+" : "+message.decode("utf-8", "replace"))
+        self.broadcast(client, message)
+
+    #This method runs one of the room commands
+    def command(self, client, command, argument):
+        if command == '/rooms':
+            self.send(client, framing.encode(rooms.room_list(self.room_counts()).encode("utf-8")))
+            return
+        if command == '/history':
+            n = int(argument) if argument.isdigit() else REPLAY
+            self.replay(client, self.rooms.room_of(client.key), n)
+            return
+        room = rooms.LOBBY if command == '/leave' else rooms.room_name(argument)
+        if room is None:
+            self.send(client, framing.encode(b"Usage: /join <room>"))
+            return
+        self.move(client, room)
+
+    #This method sends the message to every client in the sender's room except the sender.
+    #The frame is encoded once and shared by the queues of all the clients.
+    def broadcast(self, sender, message):
+        frame = framing.encode(sender.name.encode("utf-8")+b" : "+message)
+        self.deliver(frame, self.rooms.room_of(sender.key), sender)
+
+    #This method records the frame in the room's history and queues it for the room's clients
+    def deliver(self, frame, room, sender=None):
+        self.history.record(room, frame)
+        for client in self.rooms.members(room):
+            if client is not sender:
+                self.send(client, frame)
+
+    #This method queues an encoded frame for the client, disconnecting the client
+    #if it has fallen too far behind. The queue is flushed by flush_dirty().
+    def send(self, client, frame):
+        if not client.queue.push(frame):
+            self.stats.evicted()
+            print(str(client.name)+" is too slow, disconnecting.")
+            self.drop(client)
+            return
+        self.dirty.add(client)
+
+    #This method sends as much of the queue as the socket accepts right now.
+    #If something is left, it asks the selector to report when the socket is writable.
+    def flush(self, client):
+        try:
+            sent = framing.send_buffers(client.socket, client.queue.buffers())
+        except (BlockingIOError, InterruptedError):
+            sent = 0
+        except OSError:
+            self.drop(client)
+            return
+        client.queue.consume(sent)
+        events = selectors.EVENT_READ | selectors.EVENT_WRITE if len(client.queue) else selectors.EVENT_READ
+        if self.selector.get_key(client.socket).events != events:
+            self.selector.modify(client.socket, events, self.handle)
+
+    def flush_dirty(self):
+        dirty, self.dirty = self.dirty, set()
+        for client in dirty:
+            if len(client.queue) and self.clients.get(client.key) is client:
+                self.flush(client)
+
+    def drop(self, client):
+        if self.clients.get(client.key) is not client:
+            return
+        del self.clients[client.key]
+        self.rooms.leave(client.key)
+        self.dirty.discard(client)
+        self.selector.unregister(client.socket)
+        client.socket.close()
+        print(str(client.name)+" was dropped.")
+        self.left(client)
+
+    #This method is called after a client has been dropped
+    def left(self, client):
+        pass
+
+    #This method runs the event loop until terminate() is called.
+    def serve_forever(self):
+        self.running = True
+        while self.running:
+            for key, mask in self.selector.select(timeout=1):
+                callback = key.data
+                callback(key.fileobj, mask)
+            self.flush_dirty()
+        for client in list(self.clients.values()):
+            self.drop(client)
+        self.selector.close()
+        self.server.close()
+
+    def terminate(self):
+        self.running = False
+
+if __name__ == '__main__':
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8100
+    log_dir = sys.argv[2] if len(sys.argv) > 2 else None
+    raise_file_limit()
+    server = ChatServer(port=port, history=HistoryStore(log_dir=log_dir))
+    print("Starting Socket Server")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,121 @@
+"""
+   This module implements the wire protocol shared by the chat server and client.
+
+   A stream socket delivers bytes, not messages: a long message may arrive in
+   several pieces, and several short messages may arrive in one. So every message
+   is sent as a frame, a 4 byte big-endian length followed by the payload.
+
+   FrameReader receives straight into a preallocated buffer with recv_into(), and
+   only copies a payload out once the whole frame has arrived. Since a frame is
+   always decoded as a whole, a multibyte UTF-8 character is never cut in half.
+
+   send_frames() and send_buffers() hand a list of frames to the kernel in a
+   single sendmsg() call (a gather write) instead of joining them first.
+"""
+import struct
+
+HEADER = struct.Struct('!I')
+MAX_FRAME = 1024 * 1024
+
+#The most buffers a single sendmsg() call accepts on common systems (IOV_MAX)
+MAX_BUFFERS = 1024
+
+class FrameError(ValueError):
+    pass
+
+#This function encodes a payload into a frame
+def encode(payload):
+    if len(payload) > MAX_FRAME:
+        raise FrameError("Frame of %d bytes is too large" % len(payload))
+    return HEADER.pack(len(payload)) + payload
+
+#This function sends as many buffers as the socket accepts in one system call,
+#and returns the number of bytes sent. It works on non-blocking sockets.
+def send_buffers(sock, buffers):
+    buffers = buffers[:MAX_BUFFERS]
+    if hasattr(sock, 'sendmsg'):
+        return sock.sendmsg(buffers)
+    return sock.send(b''.join(buffers))
+
+#This function sends a list of buffers on a blocking socket,
+#calling sendmsg() again only when the kernel took part of them.
+def sendall_buffers(sock, buffers):
+    buffers = [memoryview(buffer) for buffer in buffers]
+    while buffers:
+        sent = send_buffers(sock, buffers)
+        while buffers and sent >= len(buffers[0]):
+            sent -= len(buffers.pop(0))
+        if sent:
+            buffers[0] = buffers[0][sent:]
+
+#This function encodes the payloads and sends them on a blocking socket
+def send_frames(sock, payloads):
+    buffers = []
+    for payload in payloads:
+        if len(payload) > MAX_FRAME:
+            raise FrameError("Frame of %d bytes is too large" % len(payload))
+        buffers.append(HEADER.pack(len(payload)))
+        buffers.append(payload)
+    sendall_buffers(sock, buffers)
+
+#This class reassembles frames from the bytes received on a socket.
+#Bytes are received into free space at the end of the buffer; complete frames
+#are consumed from the start. When the end is reached, the few bytes of the
+#last incomplete frame are moved back to the front, and the buffer only grows
+#when a single frame does not fit into it.
+class FrameReader():
+    def __init__(self, capacity=64 * 1024, max_frame=MAX_FRAME):
+        self.max_frame = max_frame
+        self.buffer = bytearray(capacity)
+        self.view = memoryview(self.buffer)
+        self.start = 0
+        self.end = 0
+
+    #This method receives from the socket into the buffer and returns the number
+    #of bytes received, 0 meaning that the connection was closed.
+    #Exceptions raised by the socket, like BlockingIOError, are passed on.
+    def recv_into(self, sock):
+        if self.end == len(self.buffer):
+            self.make_room()
+        received = sock.recv_into(self.view[self.end:])
+        self.end += received
+        return received
+
+    def make_room(self):
+        pending = self.end - self.start
+        needed = pending
+        if pending >= HEADER.size:
+            needed = max(needed, HEADER.size + HEADER.unpack_from(self.buffer, self.start)[0])
+        if needed >= len(self.buffer):
+            buffer = bytearray(max(needed, 2 * len(self.buffer)))
+            buffer[:pending] = self.view[self.start:self.end]
+            self.view.release()
+            self.buffer = buffer
+            self.view = memoryview(self.buffer)
+        else:
+            self.buffer[:pending] = self.buffer[self.start:self.end]
+        self.start = 0
+        self.end = pending
+
+    #This method yields the payload of every complete frame received so far
+    def frames(self):
+        while self.end - self.start >= HEADER.size:
+            length = HEADER.unpack_from(self.buffer, self.start)[0]
+            if length > self.max_frame:
+                raise FrameError("Frame of %d bytes is too large" % length)
+            frame_end = self.start + HEADER.size + length
+            if frame_end > self.end:
+                break
+            payload = bytes(self.view[self.start + HEADER.size:frame_end])
+            self.start = frame_end
+            yield payload
+        if self.start == self.end:
+            self.start = self.end = 0
+
+#This function reads from a blocking socket until one whole frame has arrived
+def recv_frame(sock, reader):
+    while True:
+        for payload in reader.frames():
+            return payload
+        if not reader.recv_into(sock):
+            return None
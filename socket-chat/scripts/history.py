@@ -0,0 +1,181 @@
+"""
+   This module keeps the recent messages of every chat room, so that clients
+   joining a room can catch up on the conversation.
+
+   Every room has a MessageHistory, a ring buffer of a fixed number of slots
+   holding the encoded frames that were broadcast, so recording a message never
+   allocates and never copies it. A joining client gets the last few messages
+   in one batched send. Taking them only copies the references under the lock,
+   so a burst of joining clients cannot hold up live traffic for long.
+
+   Optionally every message is also appended to a log file per room. Each record
+   is the frame followed by its length, so the log can be read backwards from the
+   end: the file is memory-mapped and only the records asked for are touched,
+   which makes backfills larger than the ring buffer cheap (see /history).
+
+   Since anybody can create rooms, nothing is kept for a room until something is
+   said in it, and both the ring buffers and the open log files are bounded: the
+   least recently used ones are dropped, or closed, beyond MAX_ROOMS and
+   MAX_OPEN_LOGS. A log that was closed is opened again on its next message.
+"""
+import mmap, os, threading, urllib.parse
+from collections import OrderedDict
+
+from framing import HEADER
+
+#Number of messages kept in memory for every room
+CAPACITY = 100
+
+#Number of messages sent to a client joining a room
+REPLAY = 20
+
+#Most messages a client can ask for with /history, and most bytes sent at once
+MAX_BACKFILL = 1000
+MAX_BACKFILL_BYTES = 512 * 1024
+
+#Most rooms whose recent messages are kept in memory, and most log files kept open
+MAX_ROOMS = 1000
+MAX_OPEN_LOGS = 64
+
+#This class is the ring buffer of the recent frames of one room
+class MessageHistory():
+    def __init__(self, capacity=CAPACITY):
+        self.lock = threading.Lock()
+        self.slots = [None] * capacity
+        self.next = 0
+        self.count = 0
+
+    def append(self, frame):
+        with self.lock:
+            self.slots[self.next] = frame
+            self.next = (self.next + 1) % len(self.slots)
+            self.count = min(self.count + 1, len(self.slots))
+
+    #This method returns up to n of the most recent frames, oldest first
+    def recent(self, n):
+        with self.lock:
+            n = min(n, self.count)
+            start = self.next - n
+            if start >= 0:
+                return self.slots[start:self.next]
+            return self.slots[start:] + self.slots[:self.next]
+
+    def __len__(self):
+        return self.count
+
+#This class is the append-only log file of one room. The file is only created,
+#and kept open, once a frame is appended.
+class HistoryLog():
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.file = None
+
+    def append(self, frame):
+        with self.lock:
+            if self.file is None:
+                self.file = open(self.path, 'ab')
+            self.file.write(frame + HEADER.pack(len(frame)))
+            self.file.flush()
+
+    #This method returns up to n of the most recent frames in the log, oldest first,
+    #stopping early once max_bytes have been collected.
+    def tail(self, n, max_bytes=MAX_BACKFILL_BYTES):
+        try:
+            log = open(self.path, 'rb')
+        except FileNotFoundError:
+            return []
+        with log:
+            size = os.fstat(log.fileno()).st_size
+            if not size:
+                return []
+            with mmap.mmap(log.fileno(), size, access=mmap.ACCESS_READ) as data:
+                frames, end, total = [], size, 0
+                while len(frames) < n and end >= HEADER.size:
+                    length = HEADER.unpack_from(data, end - HEADER.size)[0]
+                    start = end - HEADER.size - length
+                    if start < 0 or total + length > max_bytes:
+                        break
+                    frames.append(data[start:end - HEADER.size])
+                    total += length
+                    end = start
+        frames.reverse()
+        return frames
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+#This class holds the history of every room, and their logs if a log directory is given
+class HistoryStore():
+    def __init__(self, capacity=CAPACITY, log_dir=None, max_rooms=MAX_ROOMS, max_open_logs=MAX_OPEN_LOGS):
+        self.capacity = capacity
+        self.log_dir = log_dir
+        self.max_rooms = max_rooms
+        self.max_open_logs = max_open_logs
+        self.lock = threading.Lock()
+        self.histories = OrderedDict()
+        self.logs = OrderedDict()
+        if log_dir:
+            os.makedirs(log_dir, exist_ok=True)
+
+    #This method returns the ring buffer of a room, creating it if create is true,
+    #and dropping the least recently used one beyond max_rooms
+    def history(self, room, create=True):
+        with self.lock:
+            history = self.histories.get(room)
+            if history is not None:
+                self.histories.move_to_end(room)
+            elif create:
+                history = self.histories[room] = MessageHistory(self.capacity)
+                if len(self.histories) > self.max_rooms:
+                    self.histories.popitem(last=False)
+            return history
+
+    def log_path(self, room):
+        return os.path.join(self.log_dir, urllib.parse.quote(room, safe='') + '.log')
+
+    #This method returns the log a room is appended to, closing the least recently
+    #used one beyond max_open_logs
+    def log(self, room):
+        with self.lock:
+            log = self.logs.get(room)
+            if log is not None:
+                self.logs.move_to_end(room)
+                return log
+            log = self.logs[room] = HistoryLog(self.log_path(room))
+            if len(self.logs) <= self.max_open_logs:
+                return log
+            _, closed = self.logs.popitem(last=False)
+        closed.close()
+        return log
+
+    #This method records a frame broadcast in a room
+    def record(self, room, frame):
+        self.history(room).append(frame)
+        if self.log_dir:
+            self.log(room).append(frame)
+
+    #This method returns the last n frames of a room as a single buffer, ready to be
+    #queued as one send. Frames come from memory when possible, else from the log.
+    def replay(self, room, n=REPLAY):
+        n = min(n, MAX_BACKFILL)
+        history = self.history(room, create=False)
+        if n > (len(history) if history else 0) and self.log_dir:
+            frames = HistoryLog(self.log_path(room)).tail(n)
+        elif history is None:
+            frames = []
+        else:
+            frames = history.recent(n)
+            while sum(len(frame) for frame in frames) > MAX_BACKFILL_BYTES:
+                frames = frames[len(frames) // 2 + 1:]
+        return b''.join(frames)
+
+    def close(self):
+        with self.lock:
+            logs = list(self.logs.values())
+            self.logs.clear()
+        for log in logs:
+            log.close()
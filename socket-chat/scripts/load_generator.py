@@ -0,0 +1,289 @@
+"""
+   This script is a headless load generator for the chat servers.
+
+   It starts a server script in a child process, connects thousands of simulated
+   clients to it, and makes them send messages at a fixed total rate for a while.
+   Every message carries the time it was sent, so when it is broadcast back to
+   the other clients the end-to-end latency of each delivery can be measured.
+
+   At the end it reports the connect times, the delivery latency percentiles,
+   the messages sent and delivered per second, and the memory used by the server.
+   With --json the results are written as JSON (use "-" for standard output),
+   so that runs of different server versions can be compared over time.
+
+   Usage: python load_generator.py [--engine ENGINE] [--clients N] [--rate MSGS_PER_SEC]
+                                   [--size BYTES] [--duration SECONDS] [--port P]
+                                   [--label TEXT] [--json FILE]
+   where ENGINE is one of "threaded" (chat_server.py, the default), "event"
+   (event_server.py), "sharded" (sharded_server.py) or "basic" (threaded_server.py,
+   which exchanges raw bytes instead of frames).
+"""
+import argparse, json, os, platform, selectors, signal, socket, subprocess, sys, time
+
+import framing
+from event_server import raise_file_limit
+from outbound import percentile
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+#The server script of every engine, and the protocol it speaks
+ENGINES = {
+    'threaded': ('chat_server.py', 'framed'),
+    'event': ('event_server.py', 'framed'),
+    'sharded': ('sharded_server.py', 'framed'),
+    'basic': ('threaded_server.py', 'raw'),
+}
+
+#Every message starts with its send time between two markers, e.g. b"@12.345678@"
+MARKER = b'@'
+
+#This function starts the server script of an engine and waits until it accepts connections
+def start_server(engine, port, timeout=10):
+    script = os.path.join(SCRIPTS_DIR, ENGINES[engine][0])
+    process = subprocess.Popen([sys.executable, script, str(port)], start_new_session=True,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            probe = socket.create_connection(('localhost', port), timeout=1)
+            probe.close()
+            return process
+        except OSError:
+            time.sleep(0.1)
+    stop_server(process)
+    raise RuntimeError("Server "+engine+" did not start on port "+str(port))
+
+#This function stops the server along with any worker processes it started,
+#and waits until they are all gone so that the port can be reused
+def stop_server(process, timeout=10):
+    pids = process_tree(process.pid)
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except OSError:
+        process.kill()
+    process.wait()
+    deadline = time.time() + timeout
+    while time.time() < deadline and any(is_running(pid) for pid in pids):
+        time.sleep(0.05)
+
+def is_running(pid):
+    try:
+        with open('/proc/%d/stat' % pid) as stat:
+            return stat.read().rsplit(')', 1)[1].split()[0] != 'Z'
+    except OSError:
+        return False
+
+#This function returns the ids of a process and all its descendants (Linux only)
+def process_tree(pid):
+    pids = [pid]
+    try:
+        with open('/proc/%d/task/%d/children' % (pid, pid)) as children:
+            for child in children.read().split():
+                pids += process_tree(int(child))
+    except OSError:
+        pass
+    return pids
+
+#This function reads the memory and thread count of a process and its workers
+#from /proc (Linux only)
+def process_stats(pid):
+    stats = {'rss_kb': None, 'threads': None}
+    for process_id in process_tree(pid):
+        try:
+            with open('/proc/%d/status' % process_id) as status:
+                for line in status:
+                    if line.startswith('VmRSS:'):
+                        stats['rss_kb'] = (stats['rss_kb'] or 0) + int(line.split()[1])
+                    elif line.startswith('Threads:'):
+                        stats['threads'] = (stats['threads'] or 0) + int(line.split()[1])
+        except OSError:
+            pass
+    return stats
+
+#This function opens n client connections and returns them with their connect times
+def open_clients(port, n, rcvbuf=None):
+    clients, connect_times = [], []
+    for _ in range(n):
+        start = time.perf_counter()
+        try:
+            client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            if rcvbuf:
+                client.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, rcvbuf)
+            client.settimeout(5)
+            client.connect(('localhost', port))
+        except OSError:
+            client.close()
+            continue
+        connect_times.append(time.perf_counter() - start)
+        client.setblocking(False)
+        clients.append(client)
+    return clients, connect_times
+
+#This function reads and throws away whatever the server has sent so far,
+#and returns the clients whose connection is still open.
+def drain(clients, settle=1.0):
+    time.sleep(settle)
+    alive = []
+    for client in clients:
+        try:
+            while client.recv(65536):
+                pass
+            client.close()
+        except (BlockingIOError, InterruptedError):
+            alive.append(client)
+        except OSError:
+            client.close()
+    return alive
+
+#This class is one simulated client. It sends messages without ever blocking,
+#and splits what it receives into messages, either frames or lines of raw bytes.
+class SimulatedClient():
+    def __init__(self, client_socket, protocol):
+        self.socket = client_socket
+        self.framed = protocol == 'framed'
+        self.reader = framing.FrameReader(capacity=4096)
+        self.pending = bytearray()
+        self.outbox = bytearray()
+
+    def send(self, payload):
+        self.outbox += framing.encode(payload) if self.framed else payload + b'\n'
+        self.flush()
+
+    def flush(self):
+        try:
+            sent = self.socket.send(self.outbox)
+        except (BlockingIOError, InterruptedError):
+            return
+        del self.outbox[:sent]
+
+    #This method returns the messages received so far, or None once the connection is closed
+    def receive(self):
+        try:
+            if self.framed:
+                received = self.reader.recv_into(self.socket)
+                messages = list(self.reader.frames())
+            else:
+                data = self.socket.recv(65536)
+                received = len(data)
+                self.pending += data
+                messages = self.pending.split(b'\n')
+                self.pending = messages.pop()
+        except (BlockingIOError, InterruptedError):
+            return []
+        except (OSError, framing.FrameError):
+            return None
+        return messages if received else None
+
+#This function returns the send time carried by a message, or None
+def sent_at(message):
+    start = message.find(MARKER)
+    end = message.find(MARKER, start + 1)
+    if start < 0 or end < 0:
+        return None
+    try:
+        return float(message[start + 1:end])
+    except ValueError:
+        return None
+
+#This function makes the clients send `rate` messages per second in turns for
+#`duration` seconds, then keeps receiving for `grace` seconds, and returns the
+#number of messages sent and the latency of every delivery.
+def generate_load(clients, rate, size, duration, grace=2.0):
+    selector = selectors.DefaultSelector()
+    for client in clients:
+        selector.register(client.socket, selectors.EVENT_READ, client)
+    latencies, sent, closed = [], 0, 0
+    start = time.perf_counter()
+    next_send, stop_sending, stop = start, start + duration, start + duration + grace
+    now = start
+    while now < stop and closed < len(clients):
+        while now < stop_sending and next_send <= now:
+            payload = MARKER + b"%.6f" % time.perf_counter() + MARKER
+            clients[sent % len(clients)].send(payload.ljust(size, b'.'))
+            sent += 1
+            next_send += 1 / rate
+        timeout = min(next_send - now, 0.05) if now < stop_sending else 0.05
+        for key, mask in selector.select(timeout=max(timeout, 0)):
+            messages = key.data.receive()
+            if messages is None:
+                selector.unregister(key.fileobj)
+                closed += 1
+                continue
+            received_at = time.perf_counter()
+            for message in messages:
+                timestamp = sent_at(message)
+                if timestamp is not None:
+                    latencies.append(received_at - timestamp)
+        for client in clients:
+            if client.outbox:
+                client.flush()
+        now = time.perf_counter()
+    selector.close()
+    return sent, latencies, closed
+
+def ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 3)
+
+def run(engine, port, n_clients, rate, size, duration, label=None):
+    process = start_server(engine, port)
+    try:
+        idle = process_stats(process.pid)
+        sockets, connect_times = open_clients(port, n_clients)
+        sockets = drain(sockets)
+        loaded = process_stats(process.pid)
+        clients = [SimulatedClient(client_socket, ENGINES[engine][1]) for client_socket in sockets]
+        sent, latencies, closed = generate_load(clients, rate, size, duration) if clients else (0, [], 0)
+        final = process_stats(process.pid)
+        for client_socket in sockets:
+            client_socket.close()
+    finally:
+        stop_server(process)
+    expected = sent * (len(clients) - 1)
+    return {
+        'label': label,
+        'engine': engine,
+        'script': ENGINES[engine][0],
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'host': platform.node(),
+        'python': platform.python_version(),
+        'parameters': {'clients': n_clients, 'rate': rate, 'size': size, 'duration': duration},
+        'connections_held': len(clients),
+        'connections_closed_during_load': closed,
+        'connect_ms': {'p50': ms(percentile(connect_times, 50)), 'p99': ms(percentile(connect_times, 99)),
+                       'max': ms(max(connect_times) if connect_times else None)},
+        'messages_sent': sent,
+        'messages_sent_per_sec': round(sent / duration, 1),
+        'deliveries': len(latencies),
+        'deliveries_expected': expected,
+        'deliveries_per_sec': round(len(latencies) / duration, 1),
+        'delivery_ratio': round(len(latencies) / expected, 4) if expected else None,
+        'latency_ms': dict([('p%d' % q, ms(percentile(latencies, q))) for q in (50, 90, 99, 99.9)]
+                           + [('max', ms(max(latencies) if latencies else None))]),
+        'server': {'idle_rss_kb': idle['rss_kb'], 'loaded_rss_kb': loaded['rss_kb'],
+                   'final_rss_kb': final['rss_kb'], 'threads': final['threads']},
+    }
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Generate load on a chat server and measure it.")
+    parser.add_argument('--engine', default='threaded', help="one of: "+", ".join(sorted(ENGINES)))
+    parser.add_argument('--clients', type=int, default=1000)
+    parser.add_argument('--rate', type=float, default=50, help="messages per second, over all clients")
+    parser.add_argument('--size', type=int, default=64, help="message size in bytes")
+    parser.add_argument('--duration', type=float, default=10, help="seconds of sending")
+    parser.add_argument('--port', type=int, default=8101)
+    parser.add_argument('--label', help="free text stored with the results, e.g. a version")
+    parser.add_argument('--json', metavar='FILE', help="write the results as JSON to FILE, or - for stdout")
+    args = parser.parse_args()
+    if args.engine not in ENGINES:
+        parser.error("unknown engine "+args.engine)
+
+    raise_file_limit()
+    result = run(args.engine, args.port, args.clients, args.rate, args.size, args.duration, args.label)
+    if args.json == '-':
+        print(json.dumps(result, indent=2))
+    elif args.json:
+        with open(args.json, 'w') as output:
+            json.dump(result, output, indent=2)
+    if args.json != '-':
+        for key, value in result.items():
+            print("%-32s %s" % (key, value))
@@ -0,0 +1,141 @@
+"""
+   This module keeps the messages that a chat server still has to send to a client.
+
+   Broadcasting used to call sendall() on every client in turn, so a single client
+   that stopped reading would block the sender, and through it the whole chatroom.
+   Now every client owns a bounded OutboundQueue: broadcasting only appends to the
+   queues, and a writer drains each queue on its own, several messages per send.
+   A broadcast frame is encoded once and the same bytes object is queued for
+   every client, so fanning out does not copy the message.
+
+   A queue holding more than high_water bytes marks its client as lagging.
+   A client whose queue grows past max_bytes, or that has been lagging for longer
+   than max_lag seconds, has fallen too far behind and should be disconnected.
+"""
+import collections, json, threading, time
+
+HIGH_WATER = 64 * 1024
+MAX_BYTES = 1024 * 1024
+MAX_LAG = 10.0
+MAX_BATCH = 64 * 1024
+
+#This function returns the q-th percentile of a list of numbers
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))
+    return values[index]
+
+#This class collects statistics shared by all the queues of one server.
+#Samples are kept in bounded deques so that a long running server uses constant memory.
+class QueueStats():
+    def __init__(self, samples=10000):
+        self.lock = threading.Lock()
+        self.depths = collections.deque(maxlen=samples)
+        self.latencies = collections.deque(maxlen=samples)
+        self.messages = 0
+        self.sends = 0
+        self.evictions = 0
+
+    #Called for every message added to a queue, with the queue depth in bytes
+    def queued(self, depth):
+        with self.lock:
+            self.messages += 1
+            self.depths.append(depth)
+
+    #Called for every send, with the time each message in it spent in the queue
+    def sent(self, latencies):
+        with self.lock:
+            self.sends += 1
+            self.latencies.extend(latencies)
+
+    def evicted(self):
+        with self.lock:
+            self.evictions += 1
+
+    #This method returns a dictionary with the queue depth and broadcast latency percentiles
+    def summary(self):
+        with self.lock:
+            depths, latencies = list(self.depths), list(self.latencies)
+            summary = {
+                'messages': self.messages,
+                'sends': self.sends,
+                'evictions': self.evictions,
+            }
+        summary['messages_per_send'] = round(summary['messages'] / summary['sends'], 2) if summary['sends'] else None
+        for q in (50, 90, 99):
+            summary['depth_p%d_bytes' % q] = percentile(depths, q)
+            latency = percentile(latencies, q)
+            summary['latency_p%d_ms' % q] = None if latency is None else round(latency * 1000, 3)
+        return summary
+
+    def to_json(self):
+        return json.dumps(self.summary(), sort_keys=True)
+
+#This class is the bounded queue of messages waiting to be sent to one client.
+#It is not thread-safe; the threaded server guards it with its own lock.
+class OutboundQueue():
+    def __init__(self, stats=None, high_water=HIGH_WATER, max_bytes=MAX_BYTES, max_lag=MAX_LAG, max_batch=MAX_BATCH):
+        self.stats = stats
+        self.high_water = high_water
+        self.max_bytes = max_bytes
+        self.max_lag = max_lag
+        self.max_batch = max_batch
+        self.messages = collections.deque()
+        self.size = 0
+        self.offset = 0
+        self.lagging_since = None
+
+    def __len__(self):
+        return self.size
+
+    #This method appends a message to the queue. It returns False, and drops the
+    #message, when the client has fallen too far behind and should be disconnected.
+    def push(self, data):
+        now = time.monotonic()
+        if self.size + len(data) > self.max_bytes:
+            return False
+        if self.lagging_since is not None and now - self.lagging_since > self.max_lag:
+            return False
+        self.messages.append((data, now))
+        self.size += len(data)
+        if self.size > self.high_water and self.lagging_since is None:
+            self.lagging_since = now
+        if self.stats is not None:
+            self.stats.queued(self.size)
+        return True
+
+    #This method returns the pending messages as a list of buffers of at most
+    #max_batch bytes in total (or one message, if that message alone is larger),
+    #ready to be sent with a single gather write (see framing.send_buffers).
+    def buffers(self):
+        buffers, size = [], 0
+        for data, _ in self.messages:
+            if buffers and size + len(data) > self.max_batch:
+                break
+            buffers.append(data)
+            size += len(data)
+        if buffers and self.offset:
+            buffers[0] = memoryview(buffers[0])[self.offset:]
+        return buffers
+
+    #This method removes the first `sent` bytes from the queue, as returned by buffers().
+    def consume(self, sent):
+        now = time.monotonic()
+        latencies = []
+        self.size -= sent
+        while sent and self.messages:
+            data, queued_at = self.messages[0]
+            left = len(data) - self.offset
+            if sent < left:
+                self.offset += sent
+                break
+            self.messages.popleft()
+            self.offset = 0
+            sent -= left
+            latencies.append(now - queued_at)
+        if self.size <= self.high_water:
+            self.lagging_since = None
+        if self.stats is not None and latencies:
+            self.stats.sent(latencies)
@@ -0,0 +1,121 @@
+"""
+   This module keeps track of which chat room every client is in.
+
+   Clients start in the "lobby" room and move around with chat commands:
+
+      /join <room>   leave the current room and join (or create) another one
+      /leave         go back to the lobby
+      /rooms         list the rooms and how many people are in each
+      /history [n]   show the last n messages of the current room (see history.py)
+
+   A message is only broadcast to the members of the sender's room, so the cost
+   of a message depends on the size of the room, not on the number of people on
+   the server.
+
+   Members are indexed by a key (the connection id) in dictionaries, so joining
+   and leaving take the same time whatever the size of the room. Broadcasting
+   needs a list of members that does not change while it is sent to, so every
+   room also caches an immutable tuple of its members. A join or a leave drops
+   the tuple of its room, under a lock, and the next broadcast builds it again.
+   Broadcasting picks up the current tuple without taking the lock, and keeps
+   using it safely even if the room changes in the meantime.
+"""
+import threading
+
+LOBBY = 'lobby'
+MAX_ROOM_NAME = 32
+COMMANDS = ('/join', '/leave', '/rooms', '/history')
+
+#This function returns (command, argument) if the message is a room command, or None
+def parse_command(message):
+    if not message.startswith(b'/'):
+        return None
+    try:
+        parts = message.decode('utf-8').strip().split(None, 1)
+    except UnicodeDecodeError:
+        return None
+    if not parts or parts[0] not in COMMANDS:
+        return None
+    return parts[0], parts[1].strip() if len(parts) > 1 else ''
+
+#This function checks a room name typed by a user and returns it, or None if invalid
+def room_name(name):
+    name = name.strip()
+    if not name or len(name) > MAX_ROOM_NAME or not name.isprintable() or " " in name:
+        return None
+    return name
+
+#This function formats the list of members shown to a client, marking the client itself
+def member_list(names, you, title="List of Clients"):
+    msg = "--------------------------\n"+title+":\n--------------------------\n"
+    for name in names:
+        if name == you:
+            msg += name+" (YOU)\n"
+        else:
+            msg += name+"\n"
+    msg += "--------------------------\n"
+    return msg
+
+#This function formats the reply to the /rooms command
+def room_list(counts):
+    msg = "--------------------------\nList of Rooms:\n--------------------------\n"
+    for room in sorted(counts):
+        msg += room+" ("+str(counts[room])+")\n"
+    msg += "--------------------------\n"
+    return msg
+
+#This class maps rooms to their members and members to their room
+class RoomRegistry():
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.rooms = {}
+        self.snapshots = {}
+        self.membership = {}
+
+    #This method moves a member into a room and returns the room it left, if any
+    def join(self, key, member, room=LOBBY):
+        with self.lock:
+            previous = self.remove(key)
+            self.membership[key] = (room, member)
+            self.rooms.setdefault(room, {})[key] = member
+            self.snapshots.pop(room, None)
+            return previous
+
+    #This method removes a member from the registry and returns the room it left
+    def leave(self, key):
+        with self.lock:
+            return self.remove(key)
+
+    #Must be called with the lock held
+    def remove(self, key):
+        if key not in self.membership:
+            return None
+        room, member = self.membership.pop(key)
+        members = self.rooms[room]
+        del members[key]
+        if not members:
+            del self.rooms[room]
+        self.snapshots.pop(room, None)
+        return room
+
+    def room_of(self, key):
+        entry = self.membership.get(key)
+        return entry[0] if entry else None
+
+    #This method returns the members of a room as a tuple which never changes
+    def members(self, room):
+        snapshot = self.snapshots.get(room)
+        if snapshot is None:
+            with self.lock:
+                snapshot = tuple(self.rooms.get(room, {}).values())
+                if snapshot:
+                    self.snapshots[room] = snapshot
+        return snapshot
+
+    #This method returns the number of members of every room
+    def counts(self):
+        with self.lock:
+            return dict((room, len(members)) for room, members in self.rooms.items())
+
+    def __len__(self):
+        return len(self.membership)
@@ -0,0 +1,229 @@
+"""
+   This is a multi-process version of the event-driven chat server.
+
+   A single Python process can only use one core for decoding and broadcasting
+   messages. This script starts several worker processes instead, all listening
+   on the same port with SO_REUSEPORT, so that the kernel spreads incoming
+   connections between them. Each worker runs its own ChatServer (see
+   event_server.py) for the clients it accepted.
+
+   The workers are connected to the main process by a local message bus made of
+   Unix socket pairs. Whenever a client joins, leaves or sends a message, its
+   worker publishes the event on the bus and the main process relays it to all
+   the other workers. Every worker keeps a copy of the list of online users
+   and their rooms, so the "List of Clients" shown to new clients includes
+   everybody, and a message is delivered to the sender's room on every worker.
+   Every worker records the messages it delivers, so each one holds the recent
+   history of every room in memory; the on-disk log of event_server.py is not
+   used here, since the workers would all be writing the same messages.
+
+   Usage: python sharded_server.py [port] [workers]
+"""
+import multiprocessing, os, selectors, socket, sys
+
+import framing, rooms
+from event_server import ChatServer, raise_file_limit
+from outbound import OutboundQueue
+
+#Kinds of events published on the bus: the first byte of every bus frame.
+#JOIN carries the room and the user name and is also published when a user
+#changes rooms, LEAVE carries the user name, and MESSAGE carries the room and
+#the encoded chat frame. Fields are separated by a null byte.
+JOIN, LEAVE, MESSAGE = b'J', b'L', b'M'
+SEPARATOR = b'\0'
+
+#The bus carries the traffic of whole workers, so it is never disconnected
+#for being slow; its queues are only bounded to catch a stuck worker.
+BUS_MAX_BYTES = 256 * 1024 * 1024
+
+#This class wraps one end of a bus connection between a worker and the main process
+class BusLink():
+    def __init__(self, link_socket):
+        link_socket.setblocking(False)
+        self.socket = link_socket
+        self.reader = framing.FrameReader()
+        self.queue = OutboundQueue(high_water=BUS_MAX_BYTES, max_bytes=BUS_MAX_BYTES, max_lag=float('inf'))
+
+    def publish(self, kind, data):
+        if not self.queue.push(framing.encode(kind+data)):
+            raise RuntimeError("Message bus is full")
+
+    #This method returns the events received so far, and False once the link is closed
+    def read(self):
+        try:
+            received = self.reader.recv_into(self.socket)
+        except (BlockingIOError, InterruptedError):
+            return [], True
+        except OSError:
+            received = 0
+        return list(self.reader.frames()), received > 0
+
+    #This method sends as much as possible and returns the selector events to wait for
+    def flush(self):
+        if len(self.queue):
+            try:
+                self.queue.consume(framing.send_buffers(self.socket, self.queue.buffers()))
+            except (BlockingIOError, InterruptedError):
+                pass
+        return selectors.EVENT_READ | selectors.EVENT_WRITE if len(self.queue) else selectors.EVENT_READ
+
+#This class is the chat server run by every worker process.
+#Its own clients are kept in self.rooms, like in ChatServer. Besides that it keeps
+#self.roster, a room registry holding the names of all the online users,
+#local or not, which is used to list the members of rooms.
+class ShardedChatServer(ChatServer):
+    def __init__(self, index, bus_socket, host='', port=8100):
+        ChatServer.__init__(self, host, port, reuse_port=True)
+        self.index = index
+        self.roster = rooms.RoomRegistry()
+        self.bus = BusLink(bus_socket)
+        self.selector.register(self.bus.socket, selectors.EVENT_READ, self.bus_handle)
+
+    def join(self, client):
+        self.enter(client.name, rooms.LOBBY)
+        ChatServer.join(self, client)
+
+    def move(self, client, room):
+        self.enter(client.name, room)
+        ChatServer.move(self, client, room)
+
+    #This method records that a local user is now in a room, and tells the other workers
+    def enter(self, name, room):
+        self.roster.join(name, name, room)
+        self.bus.publish(JOIN, room.encode("utf-8")+SEPARATOR+name.encode("utf-8"))
+
+    def left(self, client):
+        self.roster.leave(client.name)
+        self.bus.publish(LEAVE, client.name.encode("utf-8"))
+
+    def names(self, room):
+        return list(self.roster.members(room))
+
+    def room_counts(self):
+        return self.roster.counts()
+
+    #Messages are delivered to the local clients, and published for the other workers
+    def broadcast(self, sender, message):
+        frame = framing.encode(sender.name.encode("utf-8")+b" : "+message)
+        room = self.rooms.room_of(sender.key)
+        self.deliver(frame, room, sender)
+        self.bus.publish(MESSAGE, room.encode("utf-8")+SEPARATOR+frame)
+
+    #This method is the callback of the bus socket.
+    #It applies the events relayed from the other workers.
+    def bus_handle(self, bus_socket, mask):
+        if mask & selectors.EVENT_WRITE:
+            self.flush_bus()
+        if not mask & selectors.EVENT_READ:
+            return
+        events, connected = self.bus.read()
+        for event in events:
+            kind, data = event[:1], event[1:]
+            if kind == JOIN:
+                room, name = data.decode("utf-8").split("\0")
+                self.roster.join(name, name, room)
+            elif kind == LEAVE:
+                self.roster.leave(data.decode("utf-8"))
+            elif kind == MESSAGE:
+                room, frame = data.split(SEPARATOR, 1)
+                self.deliver(frame, room.decode("utf-8"))
+        if not connected:
+            #The main process is gone, so shut the worker down
+            self.terminate()
+
+    def flush_bus(self):
+        events = self.bus.flush()
+        if self.selector.get_key(self.bus.socket).events != events:
+            self.selector.modify(self.bus.socket, events, self.bus_handle)
+
+    def flush_dirty(self):
+        ChatServer.flush_dirty(self)
+        self.flush_bus()
+
+#This class wraps the event loop of the main process, which relays every event
+#published by a worker to all the other workers. It keeps its own roster so that
+#the users of a worker that dies can be removed from the lists of the others.
+class BusHub():
+    def __init__(self, bus_sockets):
+        self.selector = selectors.DefaultSelector()
+        self.links = {}
+        self.roster = {}
+        for index, bus_socket in enumerate(bus_sockets):
+            link = BusLink(bus_socket)
+            self.links[index] = link
+            self.selector.register(link.socket, selectors.EVENT_READ, index)
+
+    def relay(self, index, event):
+        for other, link in self.links.items():
+            if other != index:
+                link.queue.push(framing.encode(event))
+
+    def serve_forever(self):
+        while self.links:
+            for key, mask in self.selector.select(timeout=1):
+                index = key.data
+                link = self.links[index]
+                if mask & selectors.EVENT_WRITE:
+                    link.flush()
+                if not mask & selectors.EVENT_READ:
+                    continue
+                events, connected = link.read()
+                for event in events:
+                    kind, data = event[:1], event[1:]
+                    if kind == JOIN:
+                        self.roster[data.split(SEPARATOR)[1]] = index
+                    elif kind == LEAVE:
+                        self.roster.pop(data, None)
+                    self.relay(index, event)
+                if not connected:
+                    self.disconnect(index)
+            for index, link in self.links.items():
+                events = link.flush()
+                if self.selector.get_key(link.socket).events != events:
+                    self.selector.modify(link.socket, events, index)
+
+    #This method removes a worker that exited, along with its users
+    def disconnect(self, index):
+        link = self.links.pop(index)
+        self.selector.unregister(link.socket)
+        link.socket.close()
+        print("Worker "+str(index)+" exited.")
+        for name, owner in list(self.roster.items()):
+            if owner == index:
+                del self.roster[name]
+                self.relay(index, LEAVE+name)
+
+def run_worker(index, port, bus_socket):
+    raise_file_limit()
+    server = ShardedChatServer(index, bus_socket, port=port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8100
+    n_workers = int(sys.argv[2]) if len(sys.argv) > 2 else os.cpu_count()
+    if not hasattr(socket, 'SO_REUSEPORT'):
+        sys.exit("SO_REUSEPORT is not supported on this platform")
+
+    #Workers are spawned rather than forked, so that they do not inherit
+    #the main process' ends of the bus connections of the other workers
+    context = multiprocessing.get_context('spawn')
+    workers, hub_sockets = [], []
+    for index in range(n_workers):
+        hub_socket, worker_socket = socket.socketpair(socket.AF_UNIX, socket.SOCK_STREAM)
+        worker = context.Process(target=run_worker, args=(index, port, worker_socket), daemon=True)
+        worker.start()
+        worker_socket.close()
+        workers.append(worker)
+        hub_sockets.append(hub_socket)
+    print("Starting Socket Server with "+str(n_workers)+" workers")
+
+    try:
+        BusHub(hub_sockets).serve_forever()
+    except KeyboardInterrupt:
+        pass
+    for worker in workers:
+        worker.terminate()
+        worker.join()
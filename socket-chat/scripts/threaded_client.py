@@ -27,11 +27,13 @@ class ReceiveHandler(threading.Thread):
         
     #This method wraps the routine to be run on the thread.
     #It waits to receive a message, and displays it upon receiving.
+    #An empty message means that the server closed the connection.
     def run(self):
         while True:
             message = self.socket.recv(256)
             if not message:
-                continue
+                print("connection closed by the server")
+                break
             print(message.decode('utf-8'))
 
 #Start the receive routine on a thread
@@ -3,15 +3,18 @@
    It can maintain connection with multiple clients by using threads.
    It keeps a list of clients and upon receiving a message from one of the clients
    in the list, it will broadcast the message to all the other clients in the list.
+
+   Usage: python threaded_server.py [port]
 """
-import socket, threading
+import socket, threading, sys
 
 #Create socket
 server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
 print(server)
 
 #Bind to an address and start listening to maximum 2 connections
-server.bind(('', 8100))
+port = int(sys.argv[1]) if len(sys.argv) > 1 else 8100
+server.bind(('', port))
 server.listen(2)
 
 #Create an empty list of clients